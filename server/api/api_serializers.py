@@ -31,8 +31,11 @@ class GetVisContentRequestSerializer(serializers.Serializer):
     datetime_end = serializers.DateTimeField(required=False, help_text='结束时间。应当为 ISO 格式，如 2020-09-30T16:08:58.000Z。')
     channels = serializers.ListField(child=serializers.CharField(), required=False, help_text='要获取的数据通道。如果指定了 all_channel，请留空。')
     all_channels = serializers.BooleanField(required=False, help_text='是否获取所有通道。如果为 true，则 channels 字段将被忽略。', default=False)
-    target_samples = serializers.IntegerField(required=False, help_text='要获取的样本数。默认为 1000，不一定精确。')
-    smooth_algorithm = serializers.CharField(required=False, help_text='平滑算法。默认为 None。')
+    target_samples = serializers.IntegerField(required=False, help_text='要获取的样本数。默认为 2000，样本足够时返回的样本数与之一致。')
+    smooth_algorithm = serializers.ChoiceField(choices=['stride', 'm4', 'lttb'], required=False, allow_null=True,
+                                               help_text='降采样算法。stride 为等间隔抽样，m4 与 lttb 保留峰值，返回的样本数与 target_samples 一致。默认情况下，已生成摘要金字塔的文件使用 m4（长时间范围直接由金字塔计算），其余文件使用 stride。')
+    time_format = serializers.ChoiceField(choices=['iso', 'epoch_ms'], required=False, default='iso',
+                                          help_text='时间格式。iso 为 ISO 字符串，epoch_ms 为毫秒时间戳。默认为 iso。')
 
     def validate_target_samples(self, value):
         if value and (int(value) < 500 or int(value) > 10000):
@@ -110,9 +113,22 @@ class GetNcfContentRequestSerializer(serializers.Serializer):
     res_limit = serializers.IntegerField(required=False, allow_null=True, help_text="生成的每个 tiff 像素大小上界。留空表示无限制")
     filenum_limit = serializers.IntegerField(required=False, allow_null=True, help_text="生成 tiff 文件的数量上界。留空表示无限制")
 
-    return_type = serializers.CharField(required=False, help_text="留空则默认为tiff。")
+    return_type = serializers.CharField(required=False, help_text="tiff 或 array，留空则默认为tiff。array 以二进制帧流返回各切片的数组")
     channel_label = serializers.CharField(help_text="表示所请求的channel，应与dataset.variables.variable_name一致")
     scalar_format = serializers.IntegerField(required=False, help_text="array标量数据的format规则")
+    array_dtype = serializers.ChoiceField(choices=['float32', 'float16'], required=False, allow_null=True,
+                                          help_text="array 数据类型，留空则默认为float32")
+    compress = serializers.ChoiceField(choices=['gzip', 'deflate'], required=False, allow_null=True,
+                                       help_text="array 响应的压缩方式，留空表示不压缩")
+    cog = serializers.BooleanField(required=False, default=False,
+                                   help_text="是否生成带内部金字塔的 Cloud-Optimized GeoTIFF，可通过 HTTP Range 按需读取")
+
+
+class GetNcfTileRequestSerializer(serializers.Serializer):
+
+    channel_label = serializers.CharField(help_text="表示所请求的channel，应与dataset.variables.variable_name一致")
+    datetime = serializers.IntegerField(required=False, allow_null=True, help_text="时间下标，留空表示第一个时间")
+    depth = serializers.IntegerField(required=False, allow_null=True, help_text="深度下标，留空表示第一个深度")
 
 
 class GetNcfContentResponseSerializer(SuccessResponseSerializer):
@@ -0,0 +1,28 @@
+# Generated by Django 4.0.2 on 2026-10-18 10:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0035_formdatacell_value_default'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='viewtifffile',
+            name='cache_key',
+            field=models.CharField(blank=True, max_length=64, null=True, unique=True),
+        ),
+        migrations.AddField(
+            model_name='viewtifffile',
+            name='meta_data',
+            field=models.JSONField(blank=True, default=dict, null=True),
+        ),
+        migrations.AlterField(
+            model_name='viewtifffile',
+            name='last_access_time',
+            field=models.DateTimeField(blank=True, db_index=True, null=True),
+        ),
+    ]
@@ -198,8 +198,11 @@ class ViewTiffFile(models.Model):
     max_value = models.FloatField(blank = True, null = True)
     file = models.CharField(max_length = 256, blank = True, null = True)
 
+    cache_key = models.CharField(max_length = 64, unique = True, blank = True, null = True)  # 缓存键，见 NcfUtils.gen_cache_key
+    meta_data = models.JSONField(default = dict, blank = True, null = True)  # 命中缓存时直接返回的 tiff_meta
+
     create_time = models.DateTimeField(blank = True, null = True)
-    last_access_time = models.DateTimeField(blank = True, null = True)
+    last_access_time = models.DateTimeField(blank = True, null = True, db_index = True)
 
 
 class FormDataTableMeta(models.Model):
@@ -1,37 +1,47 @@
-import subprocess
 from typing import List, Tuple
 import numpy as np
 from PIL import Image
 from PIL.TiffTags import TAGS
 import os
 import sys
+import json
+import time
 import argparse
+import threading
 import tqdm
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from osgeo import gdal
 
 # Root dir is server
 from api.sklec.utils import readable_size
 
 ROOT_DIR = os.path.relpath(os.path.join(os.path.dirname(__file__), '..', '..'))
+MANIFEST_NAME = '.geotiff_compress_manifest.json'
 
 class GeoTiffCoreException(BaseException):
     pass
 
 class GeoTiffCore:
-    """
-    todo: Rewrite compress functions with osgeo.gdal. (Rather than using gdal cli.)
-    """
 
     COMPRESS_ALGO = 'lzw'
     OUTPUT_NAN_VALUE = 0
+    GRID_CACHE_SIZE = 4096
+    WINDOW_TILE_SIZE = 256  # Sample areas are grouped by tile, each group reads its own bounding window
+    WINDOW_WASTE_RATIO = 4  # Read per-point windows if a group window exceeds this times its sample areas
+
+    # Per-process cache of (geotransform, raster_size), keyed by (path, mtime, size)
+    _grid_cache = OrderedDict()
+    _grid_cache_lock = threading.Lock()
 
     # COMPRESS_ALGO = 'lzma'
 
     def __init__(self, file_path, output_dir=None):
         self.file = file_path
         self.output_dir = output_dir
-        self.image = None
-        self.meta_tags = None
+        self._image = None
+        self._meta_tags = None
+        self._dataset = None
         self.size = None
 
         if self.file.startswith('/') or self.file.startswith('..'):
@@ -49,81 +59,229 @@ class GeoTiffCore:
     def __str__(self):
         return f'<SklecVis: GeoTiffCore> {self.file}'
 
+    def close(self):
+        """
+        Release the file handles held by PIL and GDAL.
+        """
+        if self._image is not None:
+            self._image.close()
+            self._image = None
+        self._dataset = None
+
     def _load_file(self):
-        self.image = Image.open(self.file)
-        self.size = os.stat(self.file).st_size
-        self.size_readable = readable_size(self.size)
-        self.meta_tags = {TAGS[key]: self.image.tag[key] for key in self.image.tag_v2}
-        driver = gdal.GetDriverByName('GTiff')
-        self.dataset: gdal.Dataset = gdal.Open(self.file)
-        self.raster_size = [self.dataset.RasterXSize, self.dataset.RasterYSize]
-
-    def _exec_cmds(self, cmds: List[str]):
-        for cmd in cmds:
-            # stdout = subprocess.run(cmd, shell=True)
-            stdout = subprocess.run(cmd, shell=True, stdout=subprocess.PIPE)
-            if stdout.returncode != 0:
-                raise Exception(f'Error while handling {self.file}: {stdout.stdout.decode("utf-8")}')
+        """
+        Only stat the file and look up its grid. PIL and GDAL handles are opened on first access.
+        """
+        stat = os.stat(self.file)
+        self.size = stat.st_size
+        key = (os.path.realpath(self.file), stat.st_mtime_ns, stat.st_size)
+        with self._grid_cache_lock:
+            grid = self._grid_cache.get(key)
+            if grid is not None:
+                self._grid_cache.move_to_end(key)
+        if grid is None:
+            grid = (self.dataset.GetGeoTransform(), [self.dataset.RasterXSize, self.dataset.RasterYSize])
+            with self._grid_cache_lock:
+                self._grid_cache[key] = grid
+                while len(self._grid_cache) > self.GRID_CACHE_SIZE:
+                    self._grid_cache.popitem(last=False)
+        self.geotransform, self.raster_size = grid[0], list(grid[1])
 
-    def downsample_only_save(self, max_width: int = 1000, output_name: str = None, append_name: str = None):
-        if not os.path.exists(self.output_dir):
-            os.mkdir(self.output_dir)
+    @property
+    def dataset(self) -> gdal.Dataset:
+        if self._dataset is None:
+            self._dataset = gdal.Open(self.file)
+        return self._dataset
+
+    @property
+    def image(self) -> Image.Image:
+        if self._image is None:
+            self._image = Image.open(self.file)
+        return self._image
+
+    @property
+    def meta_tags(self) -> dict:
+        if self._meta_tags is None:
+            self._meta_tags = {TAGS[key]: self.image.tag[key] for key in self.image.tag_v2}
+        return self._meta_tags
+
+    @property
+    def size_readable(self) -> str:
+        return readable_size(self.size)
+
+    def _get_output_file(self, output_name: str = None, append_name: str = None) -> str:
         output_file = os.path.basename(self.file)
         if append_name:
             output_file = os.path.splitext(output_file)[0] + append_name + os.path.splitext(output_file)[1]
         elif output_name:
             output_file = output_name
-        hwratio = self.image.height / self.image.width
-        method = 'med'
+        return output_file
+
+    def _warp(self, dest: str, max_width: int, **kwargs) -> gdal.Dataset:
+        """
+        Downsample the image to max_width (keeping the aspect ratio) with gdal.Warp.
+        :param dest: Output path. Use '' with format='MEM' to keep the result in memory.
+        """
+        hwratio = self.raster_size[1] / self.raster_size[0]
         out_width = max_width
-        out_height = max_width * hwratio
-        cmds = [
-            f'gdalwarp -overwrite -ts {out_width} {out_height} -r {method} {self.file} {self.output_dir}/{output_file}',
-        ]
-        self._exec_cmds(cmds)
+        out_height = max(1, round(max_width * hwratio))
+        warp_options = gdal.WarpOptions(width=out_width, height=out_height, resampleAlg='med', **kwargs)
+        dataset = gdal.Warp(dest, self.dataset, options=warp_options)
+        if dataset is None:
+            raise GeoTiffCoreException(f'Error while warping {self.file}: {gdal.GetLastErrorMsg()}')
+        return dataset
+
+    def downsample_only_save(self, max_width: int = 1000, output_name: str = None, append_name: str = None):
+        os.makedirs(self.output_dir, exist_ok=True)
+        output_file = self._get_output_file(output_name=output_name, append_name=append_name)
+        dataset = self._warp(os.path.join(self.output_dir, output_file), max_width)
+        dataset = None  # Close and flush to disk
 
-    def downsample_compress_save(self, max_width: int = 1000, output_name: str = None, append_name: str = None):
+    def downsample_compress_save(self, max_width: int = 1000, output_name: str = None, append_name: str = None,
+                                 cog: bool = False):
+        """
+        Downsample and compress the image. The downsampled intermediate is kept in memory, so only the final
+        file is written to disk.
+        :param cog: Write a Cloud-Optimized GeoTIFF with internal overviews, so that clients can fetch only the
+            overview level and blocks they display through HTTP range requests.
+        :return: Path of the output file.
+        """
         print(f'Handling {self.file}, max_width: {max_width}')
-        if not os.path.exists(self.output_dir):
-            os.mkdir(self.output_dir)
-        output_file = os.path.basename(self.file)
-        if append_name:
-            output_file = os.path.splitext(output_file)[0] + append_name + os.path.splitext(output_file)[1]
-        elif output_name:
-            output_file = output_name
-        hwratio = self.image.height / self.image.width
-        method = 'med'
-        out_width = max_width
-        out_height = max_width * hwratio
-        # Use gdalwarp to comporess the image
-
-        cmds = [
-            f'gdalwarp -overwrite -ts {out_width} {out_height} -r {method} {self.file} {self.output_dir}/.downsampletmp_{output_file}',
-            f'gdal_translate {self.output_dir}/.downsampletmp_{output_file} {self.output_dir}/{output_file} -co TILED=YES -co COPY_SRC_OVERVIEWS=YES -co COMPRESS={self.COMPRESS_ALGO}',
-            f'rm {self.output_dir}/.downsampletmp_{output_file}'
-        ]
-        self._exec_cmds(cmds)
-
-    def compress_only_save(self, output_name: str = None, append_name: str = None):
-        self.downsample_compress_save(max_width=self.image.width, output_name=output_name, append_name=append_name)
-
-    def _get_area_value(self, row, col, radius) -> float:
-        """
-        Get the value **AROUND** the pixel at the given row and column, according to the radius.
-        :param row: row number
-        :param col: column number
-        :return: value of the pixel
-        """
-        if not self.dataset_band:
-            self.dataset_band = self.dataset.GetRasterBand(1)
-        col = col - radius + 1
-        row = row - radius + 1
+        os.makedirs(self.output_dir, exist_ok=True)
+        output_file = self._get_output_file(output_name=output_name, append_name=append_name)
+        output_path = os.path.join(self.output_dir, output_file)
+        if cog:
+            translate_options = gdal.TranslateOptions(
+                format='COG', creationOptions=[f'COMPRESS={self.COMPRESS_ALGO}', 'OVERVIEWS=AUTO'])
+        else:
+            translate_options = gdal.TranslateOptions(
+                format='GTiff',
+                creationOptions=['TILED=YES', 'COPY_SRC_OVERVIEWS=YES', f'COMPRESS={self.COMPRESS_ALGO}'])
+
+        if max_width == self.raster_size[0]:
+            downsampled = self.dataset
+        else:
+            downsampled = self._warp('', max_width, format='MEM')
+        dataset = gdal.Translate(output_path, downsampled, options=translate_options)
+        if dataset is None:
+            raise GeoTiffCoreException(f'Error while compressing {self.file}: {gdal.GetLastErrorMsg()}')
+        dataset = None  # Close and flush to disk
+        return output_path
+
+    def compress_only_save(self, output_name: str = None, append_name: str = None, cog: bool = False):
+        return self.downsample_compress_save(max_width=self.raster_size[0], output_name=output_name,
+                                             append_name=append_name, cog=cog)
+
+    @classmethod
+    def batch_compress(cls, input_dir: str, output_dir: str, max_width: int = None, append_name: str = None,
+                       cog: bool = False) -> List[str]:
+        """
+        Compress all the GeoTiff files in input_dir into output_dir.
+        :param max_width: Downsample to max_width if specified, otherwise keep the original size.
+        :return: Paths of the output files.
+        """
+        outputs = []
+        for file in sorted(os.listdir(input_dir)):
+            if not (file.endswith('.tif') or file.endswith('.tiff')):
+                continue
+            outputs.append(cls.compress_file(os.path.join(input_dir, file), output_dir, max_width=max_width,
+                                             append_name=append_name, cog=cog))
+        return outputs
+
+    @classmethod
+    def compress_file(cls, input_path: str, output_dir: str, max_width: int = None, append_name: str = None,
+                      cog: bool = False) -> str:
+        """
+        Compress a single GeoTiff file into output_dir.
+        :param max_width: Downsample to max_width if specified, otherwise keep the original size.
+        :return: Path of the output file.
+        """
+        core = cls(input_path, output_dir)
+        if max_width:
+            return core.downsample_compress_save(max_width, append_name=append_name, cog=cog)
+        return core.compress_only_save(append_name=append_name, cog=cog)
+
+    def _get_area_window(self, rows: np.ndarray, cols: np.ndarray, radius: int):
+        """
+        Get the top-left corners of the sample areas **AROUND** the given pixels, according to the radius.
+        :param rows: row numbers
+        :param cols: column numbers
+        :return: (area rows, area cols, area size)
+        """
         size = 2 * radius - 1
         colnum, rownum = self.raster_size
-        col = max(0, min(col, colnum - size - 1))
-        row = max(0, min(row, rownum - size - 1))
-        samples = self.dataset_band.ReadAsArray(col, row, size, size)
-        return np.mean(samples)
+        area_cols = np.maximum(0, np.minimum(cols - radius + 1, colnum - size - 1))
+        area_rows = np.maximum(0, np.minimum(rows - radius + 1, rownum - size - 1))
+        return area_rows, area_cols, size
+
+    def _read_window(self, row_start: int, row_end: int, col_start: int, col_end: int) -> np.ndarray:
+        """
+        Read the window [row_start, row_end) x [col_start, col_end) of the first band, clipped to the raster.
+        """
+        colnum, rownum = self.raster_size
+        row_end, col_end = min(row_end, rownum), min(col_end, colnum)
+        return self.dataset.GetRasterBand(1).ReadAsArray(col_start, row_start, col_end - col_start,
+                                                         row_end - row_start)
+
+    @staticmethod
+    def _summed_area_table(array: np.ndarray) -> np.ndarray:
+        """
+        Integral image with a leading zero row and column, so that the sum of array[r0:r1, c0:c1] is
+        table[r1, c1] - table[r0, c1] - table[r1, c0] + table[r0, c0].
+        """
+        table = np.zeros((array.shape[0] + 1, array.shape[1] + 1), dtype=np.float64)
+        np.cumsum(np.cumsum(array, axis=0, dtype=np.float64), axis=1, out=table[1:, 1:])
+        return table
+
+    @staticmethod
+    def _box_sums(table: np.ndarray, r0: np.ndarray, c0: np.ndarray, r1: np.ndarray, c1: np.ndarray) -> np.ndarray:
+        return table[r1, c1] - table[r0, c1] - table[r1, c0] + table[r0, c0]
+
+    def _get_area_values(self, rows: np.ndarray, cols: np.ndarray, radius: int) -> np.ndarray:
+        """
+        Get the mean values **AROUND** the pixels at the given rows and columns, according to the radius.
+        The sample areas are grouped by WINDOW_TILE_SIZE tiles, and only the bounding window of each group is
+        read from the raster, so memory stays around the window size even if the points are spread over the
+        scene. A sparse group, whose window is much larger than its sample areas, is read area by area.
+        As with np.mean, an area containing NaN has a NaN mean.
+        :param rows: row numbers
+        :param cols: column numbers
+        :return: mean values of the pixels
+        """
+        area_rows, area_cols, size = self._get_area_window(rows, cols, radius)
+        tile_ids = (area_rows // self.WINDOW_TILE_SIZE) * (self.raster_size[0] // self.WINDOW_TILE_SIZE + 1) + \
+            area_cols // self.WINDOW_TILE_SIZE
+        order = np.argsort(tile_ids, kind='stable')
+        groups = np.split(order, np.flatnonzero(np.diff(tile_ids[order])) + 1)
+        means = np.empty(len(rows), dtype=np.float64)
+        for group in groups:
+            window_cells = (np.ptp(area_rows[group]) + size) * (np.ptp(area_cols[group]) + size)
+            if window_cells > self.WINDOW_WASTE_RATIO * len(group) * size * size:
+                for i in group:
+                    means[i] = self._get_window_means(area_rows[i:i + 1], area_cols[i:i + 1], size)[0]
+            else:
+                means[group] = self._get_window_means(area_rows[group], area_cols[group], size)
+        return means
+
+    def _get_window_means(self, area_rows: np.ndarray, area_cols: np.ndarray, size: int) -> np.ndarray:
+        """
+        Read the bounding window of the sample areas, and take their means from summed-area tables, so the
+        cost per area does not depend on the radius.
+        """
+        row_start, col_start = area_rows.min(), area_cols.min()
+        window = self._read_window(row_start, area_rows.max() + size, col_start, area_cols.max() + size)
+        window = window.astype(np.float64)
+        nan_mask = np.isnan(window)
+        value_table = self._summed_area_table(np.where(nan_mask, 0, window))
+        nan_table = self._summed_area_table(nan_mask)
+
+        r0, c0 = area_rows - row_start, area_cols - col_start
+        r1, c1 = np.minimum(r0 + size, window.shape[0]), np.minimum(c0 + size, window.shape[1])
+        sums = self._box_sums(value_table, r0, c0, r1, c1)
+        nan_counts = self._box_sums(nan_table, r0, c0, r1, c1)
+        means = sums / ((r1 - r0) * (c1 - c0))
+        means[nan_counts > 0] = np.nan
+        return means
 
     def get_value_by_coordinates(self, lat_lngs: List[Tuple], radius: int = 1):
         """
@@ -137,34 +295,27 @@ class GeoTiffCore:
             raise GeoTiffCoreException('Fail to get value by coordinates: Radius should be larger then 0.')
         colnum = self.raster_size[0]
         rownum = self.raster_size[1]
-        band = self.dataset.GetRasterBand(1)
-        self.dataset_band = band
 
         # GetTransform will return a tuple like this: (117.0, 0.0026435045317220545, 0.0, 36.0, 0.0, -0.0026435952895938475)
         # More details at gdal docs: https://gdal.org/tutorials/geotransforms_tut.html
-        transform = self.dataset.GetGeoTransform()
-        # print(transform)
-        data = band.ReadAsArray(0, 0, colnum, rownum)
+        transform = self.geotransform
         xOrigin = transform[0]
         yOrigin = transform[3]
         pixelWidth = transform[1]
         pixelHeight = -transform[5]
-        result = []
-        for point in lat_lngs:
-            target_lat, target_lng = point
-            if target_lng < xOrigin or target_lng > xOrigin + pixelWidth * colnum or \
-                    target_lat > yOrigin or target_lat < yOrigin - pixelHeight * rownum:
-                result.append(self.OUTPUT_NAN_VALUE)
-                continue
-            col = int((point[1] - xOrigin) / pixelWidth)
-            row = int((yOrigin - point[0]) / pixelHeight)
-            val = self._get_area_value(row, col, radius)
-            # print(f'{self.file} ({col}, {row}): {val}')
-            if np.isnan(val):
-                result.append(self.OUTPUT_NAN_VALUE)
-            else:
-                result.append(val.item())
-        return result
+        result = np.full(len(lat_lngs), self.OUTPUT_NAN_VALUE, dtype=np.float64)
+        if len(lat_lngs) == 0:
+            return result.tolist()
+        points = np.asarray(lat_lngs, dtype=np.float64).reshape(-1, 2)
+        target_lat, target_lng = points[:, 0], points[:, 1]
+        inside = (target_lng >= xOrigin) & (target_lng <= xOrigin + pixelWidth * colnum) & \
+                 (target_lat <= yOrigin) & (target_lat >= yOrigin - pixelHeight * rownum)
+        if inside.any():
+            cols = ((target_lng[inside] - xOrigin) / pixelWidth).astype(int)
+            rows = ((yOrigin - target_lat[inside]) / pixelHeight).astype(int)
+            values = self._get_area_values(rows, cols, radius)
+            result[inside] = np.where(np.isnan(values), self.OUTPUT_NAN_VALUE, values)
+        return result.tolist()
 
     def get_percentile_values(self, percentiles: List[float]):
         """
@@ -175,9 +326,60 @@ class GeoTiffCore:
         pass
 
 
+def _compress_file(input_path: str, output_dir: str, max_width: int = None, append_name: str = None,
+                   cog: bool = False):
+    """
+    Compress a single file in a worker process.
+    :return: (input_path, output_path, seconds, error message or None)
+    """
+    start_time = time.time()
+    try:
+        output_path = GeoTiffCore.compress_file(input_path, output_dir, max_width=max_width,
+                                                append_name=append_name, cog=cog)
+        return input_path, output_path, time.time() - start_time, None
+    except (Exception, GeoTiffCoreException) as e:
+        return input_path, None, time.time() - start_time, str(e)
+
+
+def _load_manifest(manifest_path: str) -> dict:
+    if not os.path.exists(manifest_path):
+        return {}
+    with open(manifest_path, 'r') as f:
+        return json.load(f)
+
+
+def _save_manifest(manifest: dict, manifest_path: str):
+    # Write to a temporary file first, so an interrupted run never leaves a broken manifest
+    temporary_path = manifest_path + '.tmp'
+    with open(temporary_path, 'w') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(temporary_path, manifest_path)
+
+
+def _get_task_signature(input_path: str, max_width: int, append_name: str, cog: bool) -> dict:
+    stat = os.stat(input_path)
+    return {
+        'mtime': stat.st_mtime_ns,
+        'size': stat.st_size,
+        'max_width': max_width,
+        'append_name': append_name,
+        'cog': cog,
+    }
+
+
+def _is_up_to_date(manifest_entry: dict, signature: dict) -> bool:
+    if manifest_entry is None or manifest_entry.get('signature') != signature:
+        return False
+    output_path = manifest_entry.get('output')
+    return output_path is not None and os.path.exists(output_path) and \
+        os.stat(output_path).st_mtime_ns == manifest_entry.get('output_mtime')
+
+
 def main():
     """
-    Cli tools for compressing TIFF files. Won't be used in production.
+    Cli tools for compressing TIFF files in parallel. Won't be used in production.
+    Finished files are recorded in a manifest in the output directory, so an interrupted run resumes
+    from where it stopped, and files whose input and options did not change are skipped.
     :return:
     """
     parser = argparse.ArgumentParser(description='Compress GeoTiff files')
@@ -189,21 +391,65 @@ def main():
                         help='Append postfix to the files')
     parser.add_argument('-m', '--max-width', type=int, required=False,
                         help='Max width of the output tiff images. If not specified, the original image will be used.')
+    parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count(), required=False,
+                        help='Number of worker processes. Default is the number of CPUs.')
+    parser.add_argument('--cog', action='store_true',
+                        help='Write Cloud-Optimized GeoTiff files with internal overviews.')
+    parser.add_argument('-f', '--force', action='store_true',
+                        help='Compress all the files even if the outputs are up to date.')
 
     if len(sys.argv) == 1:
         parser.print_help()
 
     args = parser.parse_args()
 
-    file_list = os.listdir(os.path.join(ROOT_DIR, args.input))
-    for file in tqdm.tqdm(file_list):
-        if file.endswith('.tif') or file.endswith('.tiff'):
-            gt = GeoTiffCore(os.path.join(ROOT_DIR, args.input, file), args.output)
-            pass
-            # if args.max_width:
-            #     gt.downsample_compress_save(args.max_width, append_name=args.postfix)
-            # else:
-            #     gt.compress_only_save(append_name=args.postfix)
+    input_dir = os.path.join(ROOT_DIR, args.input)
+    output_dir = args.output if args.output.startswith('/') else os.path.join(ROOT_DIR, args.output)
+    os.makedirs(output_dir, exist_ok=True)
+    manifest_path = os.path.join(output_dir, MANIFEST_NAME)
+    manifest = {} if args.force else _load_manifest(manifest_path)
+
+    tasks = []
+    for file in sorted(os.listdir(input_dir)):
+        if not (file.endswith('.tif') or file.endswith('.tiff')):
+            continue
+        input_path = os.path.abspath(os.path.join(input_dir, file))
+        signature = _get_task_signature(input_path, args.max_width, args.postfix, args.cog)
+        if _is_up_to_date(manifest.get(input_path), signature):
+            continue
+        tasks.append((input_path, signature))
+    print(f'{len(tasks)} file(s) to compress, {len(manifest)} file(s) already in manifest.')
+
+    start_time = time.time()
+    input_bytes, output_bytes, failed = 0, 0, 0
+    with ProcessPoolExecutor(max_workers=args.jobs) as executor:
+        futures = {
+            executor.submit(_compress_file, input_path, output_dir, args.max_width, args.postfix, args.cog): signature
+            for input_path, signature in tasks
+        }
+        for future in tqdm.tqdm(as_completed(futures), total=len(futures)):
+            input_path, output_path, seconds, error = future.result()
+            if error is not None:
+                failed += 1
+                print(f'Failed {input_path}: {error}')
+                continue
+            input_size, output_size = os.path.getsize(input_path), os.path.getsize(output_path)
+            input_bytes += input_size
+            output_bytes += output_size
+            print(f'{os.path.basename(input_path)}: {readable_size(input_size)} -> {readable_size(output_size)} '
+                  f'in {seconds:.2f}s ({readable_size(input_size / max(seconds, 1e-6))}/s)')
+            manifest[input_path] = {
+                'signature': futures[future],
+                'output': output_path,
+                'output_mtime': os.stat(output_path).st_mtime_ns,
+            }
+            _save_manifest(manifest, manifest_path)
+
+    elapsed = time.time() - start_time
+    print(f'Compressed {len(tasks) - failed} file(s), {failed} failed, in {elapsed:.2f}s. '
+          f'{readable_size(input_bytes)} -> {readable_size(output_bytes)}, '
+          f'{readable_size(input_bytes / max(elapsed, 1e-6))}/s, '
+          f'{(len(tasks) - failed) / max(elapsed, 1e-6):.2f} file(s)/s.')
 
 
 if __name__ == '__main__':
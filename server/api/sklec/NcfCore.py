@@ -1,8 +1,11 @@
 import os
 import math
+import json
+import hashlib
 import numpy as np
 import netCDF4
 from api.sklec.SKLECBaseCore import SKLECBaseCore
+from api.sklec.utils import CorePool
 from django.core.files import File
 from django.core.files.storage import default_storage
 from osgeo import gdal, osr
@@ -12,7 +15,14 @@ import re
 import uuid
 import time
 import datetime
+import fcntl
+import struct
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from collections import defaultdict, namedtuple
+from django.db import connection
+from django.db.models import Sum
+from django.utils import timezone
 from api.models import *
 
 ROOT_DIR = os.path.relpath(os.path.join(os.path.dirname(__file__), '..'))
@@ -29,39 +39,153 @@ class NcfCoreException:
 
 
 class NcfCacheManager:
+    """
+    nc_to_tiff 缓存管理。缓存条目的元数据（大小、最后访问时间等）记录在 ViewTiffFile 中，
+    查找、统计与淘汰均通过索引完成，请求路径上不再扫描缓存文件夹。
+    """
     CACHE_FOLDER_DIR = os.path.join(settings.MEDIA_ROOT, 'cache_files', 'nc_to_tiff')
+    ELIMINATE_LOCK_PATH = os.path.join(CACHE_FOLDER_DIR, '.eliminate.lock')
     GIGABYTE = 1024 ** 3
     CACHE_SIZE = 5 * GIGABYTE
     ELIMINATE_SIZE = 2 * GIGABYTE
+    ELIMINATE_CHECK_INTERVAL = 60  # 每个进程两次检查缓存大小的最小间隔（秒）
+    LEASE_SECONDS = 10 * 60  # 最近被访问过的条目在租期内不会被淘汰，保证客户端能取回刚返回的 tiff
+    # 正在写入的临时文件：<cache_key>_<uuid>.tiff 与 warp_tiff 的 *_warp.tiff
+    TEMPORARY_FILE_PATTERN = re.compile(r'^[0-9a-f]{40}_[0-9a-f]+\.tiff$|_warp\.tiff$')
+
+    _eliminate_thread = None
+    _eliminate_checked_at = 0.0
+    _eliminate_thread_lock = threading.Lock()
 
     @classmethod
-    def get_dir_size(cls, p_doc):
-        size = 0.0
-        status = []
-        for root, dirs, files in os.walk(p_doc):
-            for file in files:
-                file_size = os.path.getsize(os.path.join(root, file))
-                file_time = os.path.getatime(os.path.join(root, file))
-                size += file_size
-                status.append({'file_atime': file_time,
-                               'file_size': file_size,
-                               'file_name': file})
-        # 按照访问时间从小到大排序
-        return size, status
+    def get_cache_size(cls):
+        size = ViewTiffFile.objects.filter(is_preview=False).aggregate(size=Sum('file_size')).get('size')
+        return size or 0
+
+    @classmethod
+    def schedule_eliminate_cache(cls):
+        """在后台线程中执行缓存淘汰，请求线程不等待。同一进程内同时只有一个淘汰线程"""
+        with cls._eliminate_thread_lock:
+            if time.time() - cls._eliminate_checked_at < cls.ELIMINATE_CHECK_INTERVAL:
+                return
+            if cls._eliminate_thread is not None and cls._eliminate_thread.is_alive():
+                return
+            cls._eliminate_checked_at = time.time()
+            cls._eliminate_thread = threading.Thread(target=cls._eliminate_cache_in_background,
+                                                     name='NcfCacheJanitor', daemon=True)
+            cls._eliminate_thread.start()
+
+    @classmethod
+    def _eliminate_cache_in_background(cls):
+        try:
+            cls.eliminate_cache()
+        except Exception as e:
+            print(f'Eliminate nc_to_tiff cache failed: {e.args}')
+        finally:
+            # 后台线程持有独立的数据库连接，结束时需手动关闭
+            connection.close()
 
     @classmethod
     def eliminate_cache(cls):
-        """缓存文件夹超过5GB，则根据最后访问时间按LRU规则淘汰，直到文件夹大小小于2GB"""
-        doc_size, status = cls.get_dir_size(NcfUtils.CACHE_FOLDER_DIR)
+        """
+        缓存超过 CACHE_SIZE，则根据最后访问时间按LRU规则淘汰，直到缓存大小小于 ELIMINATE_SIZE。
+        通过文件锁保证多个 uWSGI worker 不会同时淘汰；租期内的条目不会被淘汰。
+        """
+        os.makedirs(cls.CACHE_FOLDER_DIR, exist_ok=True)
+        with open(cls.ELIMINATE_LOCK_PATH, 'w') as lock_file:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                # 其它 worker 正在淘汰
+                return
+            try:
+                cls._eliminate_cache_locked()
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    @classmethod
+    def _eliminate_cache_locked(cls):
+        doc_size = cls.get_cache_size()
         if doc_size < cls.CACHE_SIZE:
             return
-        doc_counter = 0
-        status.sort(key=lambda x: x['file_atime'])
-        while doc_size > cls.ELIMINATE_SIZE and doc_counter < len(status):
-            oldest_status = status[doc_counter]
-            os.remove(os.path.join(NcfUtils.CACHE_FOLDER_DIR, oldest_status['file_name']))
-            doc_size -= oldest_status['file_size']
-            doc_counter += 1
+        lease_time = timezone.now() - datetime.timedelta(seconds=cls.LEASE_SECONDS)
+        oldest_entries = ViewTiffFile.objects.filter(is_preview=False, last_access_time__lt=lease_time) \
+            .order_by('last_access_time').only('id', 'file', 'file_size', 'last_access_time')
+        for entry in oldest_entries.iterator(chunk_size=500):
+            if doc_size <= cls.ELIMINATE_SIZE:
+                break
+            # 条件删除：若条目在此期间被访问（last_access_time 已更新），则放弃淘汰该条目
+            deleted, _ = ViewTiffFile.objects.filter(id=entry.id, last_access_time=entry.last_access_time).delete()
+            if deleted == 0:
+                continue
+            if entry.file is not None and os.path.exists(entry.file):
+                os.remove(entry.file)
+            doc_size -= entry.file_size or 0
+
+    @classmethod
+    def get_cached_tiff_meta(cls, cache_key):
+        """根据缓存键查找已生成的 tiff，命中则返回其 tiff_meta，否则返回 None"""
+        entry = ViewTiffFile.objects.filter(cache_key=cache_key).only('id', 'file', 'meta_data').first()
+        if entry is None:
+            return None
+        # 先更新访问时间以取得租期，若条目恰好已被淘汰则视为未命中
+        updated = ViewTiffFile.objects.filter(id=entry.id).update(last_access_time=timezone.now())
+        if updated == 0:
+            return None
+        if entry.file is None or not os.path.exists(entry.file):
+            ViewTiffFile.objects.filter(id=entry.id).delete()
+            return None
+        return entry.meta_data
+
+    @classmethod
+    def save_cached_tiff_meta(cls, cache_key, tiff_meta):
+        """tiff 写入完成后再登记，保证命中时 tiff 一定完整"""
+        now = timezone.now()
+        ViewTiffFile.objects.update_or_create(cache_key=cache_key, defaults={
+            'is_preview': False,
+            'file': tiff_meta.get('file_path'),
+            'file_name': tiff_meta.get('file_name'),
+            'file_size': tiff_meta.get('file_size'),
+            'datetime': tiff_meta.get('time_index'),
+            'depth': tiff_meta.get('depth_index'),
+            'longitude_start': tiff_meta.get('longitude_start'),
+            'longitude_end': tiff_meta.get('longitude_end'),
+            'latitude_start': tiff_meta.get('latitude_start'),
+            'latitude_end': tiff_meta.get('latitude_end'),
+            'label': tiff_meta.get('label'),
+            'min_value': tiff_meta.get('min_value'),
+            'max_value': tiff_meta.get('max_value'),
+            'meta_data': tiff_meta,
+            'create_time': now,
+            'last_access_time': now,
+        })
+
+    @classmethod
+    def rebuild_index(cls):
+        """
+        扫描一次缓存文件夹以校正索引：登记未被索引的文件，删除文件已不存在的条目。
+        仅用于维护脚本，不应在请求中调用。
+        """
+        indexed_files = set(ViewTiffFile.objects.filter(is_preview=False).values_list('file', flat=True))
+        registered, removed = 0, 0
+        for root, dirs, files in os.walk(cls.CACHE_FOLDER_DIR):
+            for file in files:
+                file_path = os.path.join(root, file)
+                if file_path in indexed_files:
+                    continue
+                # 跳过锁文件等隐藏文件与正在写入的临时文件，它们不是缓存条目
+                if file.startswith('.') or cls.TEMPORARY_FILE_PATTERN.search(file):
+                    continue
+                file_time = datetime.datetime.fromtimestamp(os.path.getatime(file_path), tz=datetime.timezone.utc)
+                ViewTiffFile.objects.create(is_preview=False, file=file_path, file_name=file,
+                                            file_size=os.path.getsize(file_path),
+                                            create_time=file_time, last_access_time=file_time)
+                registered += 1
+        for entry in ViewTiffFile.objects.filter(is_preview=False).only('id', 'file'):
+            if entry.file is None or not os.path.exists(entry.file):
+                entry.delete()
+                removed += 1
+        return registered, removed
 
 
 class NcfUtils:
@@ -86,6 +210,10 @@ class NcfUtils:
         '%Y-%m-%d'
     ]
     REPLACE_VALUE = 9.9e36
+    ARRAY_FRAME_DTYPES = {
+        'float32': np.dtype('<f4'),
+        'float16': np.dtype('<f2'),
+    }
 
     class Dim:
         """
@@ -123,6 +251,17 @@ class NcfUtils:
                 return i
         return len(lst)
 
+    @classmethod
+    def get_idx_from_sorted_array(cls, values, arr, name=None):
+        """get_idx_from_sorted_list 的向量化版本，一次性求出多个值在升序数组中的下标"""
+        values = np.asarray(values, dtype=np.float64)
+        arr = np.asarray(arr)
+        mn, mx = arr.min(), arr.max()
+        out_of_range = (values < mn) | (values > mx)
+        assert not out_of_range.any(), \
+            f'{name} value {values[out_of_range][0]} out of range [{mn}, {mx}].'
+        return np.minimum(np.searchsorted(arr, values, side='right'), len(arr) - 1)
+
     @classmethod
     def try_get_attr(cls, obj, attr):
         if hasattr(obj, attr):
@@ -235,6 +374,10 @@ class NcfUtils:
 
     @classmethod
     def initialize_tiff(cls, data_array, lon_list, lat_list, tiff_path, driver_name='GTiff', flush=True):
+        """
+        driver_name='MEM' 时 tiff_path 可为空字符串，栅格只存在于内存中，flush=False 时返回该数据集，
+        可直接作为 warp_tiff 的 src_tiff 使用
+        """
         lon_min, lon_max, lat_min, lat_max = lon_list.min(), lon_list.max(), lat_list.min(), lat_list.max()
         lon_res = (lon_max - lon_min) / (len(lon_list) - 1)
         lat_res = (lat_max - lat_min) / (len(lat_list) - 1)
@@ -245,47 +388,116 @@ class NcfUtils:
         if flush:
             dest_tiff.FlushCache()  # 写入磁盘
             dest_tiff = None        # 关闭文件（否则不能读取）
+        return dest_tiff
 
     @classmethod
     def warp_tiff(cls, tiff_path, src_tiff=None, warp_epsg=4326,
-                  tiled=True, compress='LZW', predictor=1, width=0, height=0):
-        """ compress = 'LZW'(predictor) / 'Deflate'(predictor, currently best) / 'Packbits' """
+                  tiled=True, compress='LZW', predictor=1, width=0, height=0,
+                  dst_epsg=None, output_bounds=None, nodata=None, cog=False):
+        """
+        compress = 'LZW'(predictor) / 'Deflate'(predictor, currently best) / 'Packbits'
+        指定 src_tiff（文件路径或已打开的数据集，如 MEM 数据集）时直接写入 tiff_path；
+        否则原地转换 tiff_path，需经过一个临时文件
+        dst_epsg / output_bounds（目标坐标系下的 minx, miny, maxx, maxy）用于输出指定范围的瓦片，
+        nodata 同时作为源与目标的缺测值
+        cog=True 时输出带内部金字塔的 Cloud-Optimized GeoTIFF，客户端可通过 HTTP Range 只取所需的层级与块
+        """
         # srs = osr.SpatialReference()
         # srs.ImportFromEPSG(warp_epsg)
-        warp_options = gdal.WarpOptions(
-            # srcSRS=srs.ExportToWkt(),
-            srcSRS=f'EPSG:{warp_epsg}',
-            creationOptions=[
+        if cog:
+            # COG 总是分块存储，不接受 TILED 选项
+            creation_options = [
+                f'COMPRESS={compress}' if compress is not None else '',
+                f'PREDICTOR={predictor}',
+                'OVERVIEWS=AUTO',
+            ]
+        else:
+            creation_options = [
                 'TILED=YES' if tiled else 'TILED=NO',
                 f'COMPRESS={compress}' if compress is not None else '',
                 f'PREDICTOR={predictor}'
-            ],
+            ]
+        warp_options = gdal.WarpOptions(
+            # srcSRS=srs.ExportToWkt(),
+            srcSRS=f'EPSG:{warp_epsg}',
+            format='COG' if cog else 'GTiff',
+            creationOptions=creation_options,
             width=width,
             height=height,
+            dstSRS=f'EPSG:{dst_epsg}' if dst_epsg is not None else None,
+            outputBounds=output_bounds,
+            srcNodata=nodata,
+            dstNodata=nodata,
         )
+        if src_tiff is not None:
+            return gdal.Warp(tiff_path, src_tiff, options=warp_options)
         temperate_tiff_path = tiff_path[:-5] + '_warp.tiff'
-        dest_tiff = gdal.Warp(temperate_tiff_path, src_tiff if src_tiff is not None else tiff_path,
-                              options=warp_options)
+        dest_tiff = gdal.Warp(temperate_tiff_path, tiff_path, options=warp_options)
+        dest_tiff = None
         os.remove(tiff_path)
         os.rename(temperate_tiff_path, tiff_path)
         return dest_tiff
 
+    @classmethod
+    def pack_array_frame(cls, header, data_array):
+        """
+        二进制帧：4 字节小端 header 长度 + UTF-8 JSON header + 小端数组数据（行优先）。
+        header 中补充 shape、dtype 与数据字节数
+        """
+        data = np.ascontiguousarray(data_array).tobytes()
+        header = dict(header, shape=list(data_array.shape), dtype=data_array.dtype.str, byte_length=len(data))
+        header_bytes = json.dumps(header).encode('utf-8')
+        return struct.pack('<I', len(header_bytes)) + header_bytes + data
+
     @classmethod
     def uuid4_short(cls, length=settings.UUID_SHORT_LENGTH):
         return uuid.uuid4().hex[:length]
 
+    @classmethod
+    def get_file_signature(cls, filepath):
+        """文件签名：路径、修改时间与大小。文件被替换后签名随之改变"""
+        stat = os.stat(filepath)
+        return {
+            'file': os.path.abspath(filepath),
+            'mtime': stat.st_mtime_ns,
+            'size': stat.st_size,
+        }
+
+    @classmethod
+    def gen_cache_key(cls, file_signature, **params):
+        """根据源文件签名与请求参数生成确定性的缓存键"""
+        payload = json.dumps({'signature': file_signature, 'params': params}, sort_keys=True, default=str)
+        return hashlib.sha1(payload.encode('utf-8')).hexdigest()
+
 
 class NcfCore(SKLECBaseCore):
     """ 重构 NcfCoreClass，将逐步迁移方法至该类 """
 
+    VQ_BOUNDING_SIZE_LIMIT = 256 * 256  # 批量时间序列查询一次读取的最大经纬度格点数
+    MAX_CHUNK_CACHE_SIZE = 256 * 1024 ** 2  # read_hyperslab 单次读取涉及的 chunk 总量上限，也是临时 chunk cache 的上限
+    MAX_BULK_READ_SIZE = 512 * 1024 ** 2  # 多切片请求一次批量读取的数据量上限
+    TILE_SIZE = 256
+    WEB_MERCATOR_ORIGIN = 20037508.342789244
+    TIMESERIES_STORE_SUFFIX = '.ts.nc'
+    TIMESERIES_CHUNK_BYTES = 1024 ** 2  # 时间序列副本中单个 chunk 的目标大小
+    TIMESERIES_COPY_BYTES = 256 * 1024 ** 2  # 生成时间序列副本时单次读入内存的数据量上限
+
+    # 上传后生成时间序列副本的后台线程，每个进程同时只生成一个副本
+    _timeseries_store_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='NcfTimeseriesStore')
+
     def __init__(self, filepath):
         self.filepath = os.path.join(settings.MEDIA_ROOT, filepath)
         self.filename = os.path.split(self.filepath)[-1]
+        self.file_signature = NcfUtils.get_file_signature(self.filepath)
         self.dataset = netCDF4.Dataset(self.filepath)
         self.dimensions = self.dataset.dimensions
         self.variables = self.dataset.variables
         self.dimension_fields = {}
         self.variable_fields = {}
+        self.last_read_stats = None
+        self.timeseries_dataset = None
+        # netCDF4/HDF5 不是线程安全的，同一实例上的读取需串行
+        self.read_lock = threading.RLock()
 
         self._init_dimension_fields()
         self._init_variable_fields()
@@ -340,21 +552,266 @@ class NcfCore(SKLECBaseCore):
         slice_dict = {
             'longitude': longitude_index,
             'latitude': latitude_index,
-            'time': time_index if time_index is not None else Ellipsis,
-            'depth': depth_index if depth_index is not None else Ellipsis,
+            'time': time_index if time_index is not None else slice(None),
+            'depth': depth_index if depth_index is not None else slice(None),
         }
-
-        slices = []
-        for dimension in self.variables.get(label).dimensions:
-            normalized_dimension = NcfUtils.normalized_dimension(dimension)
-            slices.append(slice_dict.get(normalized_dimension))
-        data_array = np.asarray(self.variables.get(label)[slices]).astype(np.float)
+        data_array = self.read_hyperslab(label, slice_dict, use_timeseries_store=True).astype(np.float64)
 
         if (fill_value is not None) and (replace_value is not None):
             fill_pos = np.where(data_array == fill_value)
             data_array[fill_pos] = replace_value
         return data_array
 
+    def read_hyperslab(self, label, slice_dict, use_timeseries_store=False):
+        """
+        按变量在文件中的 chunk 布局读取超立方体。能放入 MAX_CHUNK_CACHE_SIZE 时一次读取，否则将连续的时间
+        chunk 合并为尽可能大的块分块读取。读取期间 chunk cache 临时调整到能容纳一个时间 chunk 涉及的 chunk。
+        读取统计（涉及的 chunk 数、按 chunk 大小估算的解压字节数等）记录在 self.last_read_stats 中。
+        :param slice_dict: 规范化维度名 -> 下标或 slice
+        :param use_timeseries_store: 若存在按时间维分块的副本（见 generate_timeseries_store），则从副本读取
+        """
+        with self.read_lock:
+            return self._read_hyperslab(label, slice_dict, use_timeseries_store)
+
+    def _read_hyperslab(self, label, slice_dict, use_timeseries_store):
+        variable = self.get_timeseries_variable(label) if use_timeseries_store else self.variables.get(label)
+        normalized_dimensions = [NcfUtils.normalized_dimension(dim) for dim in variable.dimensions]
+        slices = [slice_dict.get(dim) for dim in normalized_dimensions]
+        chunking = variable.chunking()
+        if chunking == 'contiguous' or 'time' not in normalized_dimensions \
+                or not isinstance(slice_dict.get('time'), slice):
+            data_array = np.asarray(variable[tuple(slices)])
+            self.last_read_stats = {
+                'chunking': chunking,
+                'chunks': None,
+                'blocks': 1,
+                'bytes_decompressed_estimate': data_array.nbytes,
+            }
+            return data_array
+
+        # 每个维度上被访问的下标范围 [start, stop)
+        ranges = []
+        for dim, sl, size in zip(normalized_dimensions, slices, variable.shape):
+            if isinstance(sl, slice):
+                start, stop, step = sl.indices(size)
+                ranges.append((start, max(start + 1, stop)))
+            else:
+                ranges.append((int(sl), int(sl) + 1))
+
+        time_axis = normalized_dimensions.index('time')
+        time_chunk = chunking[time_axis]
+        # 一个时间 chunk 上涉及的 chunk 数
+        chunks_per_time_chunk = 1
+        for axis, ((start, stop), chunk) in enumerate(zip(ranges, chunking)):
+            if axis != time_axis:
+                chunks_per_time_chunk *= (stop - 1) // chunk - start // chunk + 1
+        chunk_bytes = int(np.prod(chunking)) * variable.dtype.itemsize
+        # 每块合并的时间 chunk 数：块内全部 chunk 不超过 MAX_CHUNK_CACHE_SIZE
+        time_chunks_per_block = max(1, self.MAX_CHUNK_CACHE_SIZE // (chunks_per_time_chunk * chunk_bytes))
+
+        # 单次读取中每个 chunk 只被访问一次，chunk cache 只需容纳一个时间 chunk 涉及的 chunk。
+        # core 常驻于 NCF_CORE_POOL，读取结束后恢复原设置，避免每个变量长期占用大块缓存
+        cache_size, cache_nelems, cache_preemption = variable.get_var_chunk_cache()
+        required_cache_size = min(chunks_per_time_chunk * chunk_bytes, self.MAX_CHUNK_CACHE_SIZE)
+        cache_changed = required_cache_size > cache_size or chunks_per_time_chunk > cache_nelems
+        if cache_changed:
+            variable.set_var_chunk_cache(size=max(cache_size, required_cache_size),
+                                         nelems=max(cache_nelems, 2 * chunks_per_time_chunk + 1),
+                                         preemption=cache_preemption)
+
+        # 时间维按 chunk 边界对齐分块读取，每块包含 time_chunks_per_block 个时间 chunk
+        time_start, time_stop = ranges[time_axis]
+        time_slice = slices[time_axis]
+        time_step = time_slice.indices(variable.shape[time_axis])[2]
+        remaining_time_axis = [i for i, sl in enumerate(slices) if isinstance(sl, slice)].index(time_axis)
+        blocks = []
+        block_start = time_start
+        try:
+            while block_start < time_stop:
+                block_stop = min((block_start // time_chunk + time_chunks_per_block) * time_chunk, time_stop)
+                block_slices = list(slices)
+                block_slices[time_axis] = slice(block_start, block_stop, time_step)
+                blocks.append(np.asarray(variable[tuple(block_slices)]))
+                # 保证下一块的起点仍落在步长序列上
+                block_start += -(-(block_stop - block_start) // time_step) * time_step
+        finally:
+            if cache_changed:
+                variable.set_var_chunk_cache(size=cache_size, nelems=cache_nelems, preemption=cache_preemption)
+        data_array = blocks[0] if len(blocks) == 1 else np.concatenate(blocks, axis=remaining_time_axis)
+
+        time_chunks = len(np.unique(np.arange(time_start, time_stop, time_step) // time_chunk))
+        self.last_read_stats = {
+            'chunking': chunking,
+            'chunks': time_chunks * chunks_per_time_chunk,
+            'blocks': len(blocks),
+            'bytes_decompressed_estimate': time_chunks * chunks_per_time_chunk * chunk_bytes,
+        }
+        return data_array
+
+    @classmethod
+    def get_timeseries_store_path(cls, filepath):
+        return os.path.splitext(filepath)[0] + cls.TIMESERIES_STORE_SUFFIX
+
+    def get_timeseries_variable(self, label):
+        """若存在按时间维分块的副本且包含该变量，则返回副本中的变量，否则返回原文件中的变量"""
+        if self.timeseries_dataset is None:
+            timeseries_store_path = self.get_timeseries_store_path(self.filepath)
+            if not os.path.exists(timeseries_store_path) or \
+                    os.path.getmtime(timeseries_store_path) < os.path.getmtime(self.filepath):
+                return self.variables.get(label)
+            self.timeseries_dataset = netCDF4.Dataset(timeseries_store_path)
+        if label not in self.timeseries_dataset.variables.keys():
+            return self.variables.get(label)
+        return self.timeseries_dataset.variables.get(label)
+
+    def generate_timeseries_store(self, target_path=None):
+        """
+        生成按时间维连续分块的副本，用于加速单点时间序列查询。副本与原文件的维度和变量命名一致，
+        仅包含同时具有时间与经纬度维度的变量（以及维度变量）。
+        注意：原文件通常按时间分块、每个 chunk 覆盖整个经纬度网格，按纬度带复制时每一带都要解压全部源 chunk，
+        总开销约为 变量大小 / TIMESERIES_COPY_BYTES 遍完整读取，随文件大小平方增长。数 GB 的文件需数十遍读取，
+        因此只应在维护脚本（scripts/gen_ncf_timeseries_store.py）或后台线程中调用，不应在请求中调用。
+        :param target_path: 副本路径，默认为原文件同目录下的 <name>.ts.nc
+        :return: 副本路径
+        """
+        if target_path is None:
+            target_path = self.get_timeseries_store_path(self.filepath)
+        if not self.dimension_fields.get('time').exists:
+            return None
+        temporary_path = f'{target_path}.{NcfUtils.uuid4_short()}'
+        target = netCDF4.Dataset(temporary_path, 'w', format='NETCDF4')
+        try:
+            for ds_dim, dimension in self.dimensions.items():
+                target.createDimension(ds_dim, dimension.size)
+            for ds_var, variable in self.variables.items():
+                normalized_dimensions = self.variable_fields.get(ds_var).normalized_dimensions
+                is_dimension = ds_var in self.dimensions.keys()
+                if not is_dimension and not ({'time', 'latitude', 'longitude'} <= set(normalized_dimensions)):
+                    continue
+                variable.set_auto_maskandscale(False)
+                chunksizes = None
+                if not is_dimension:
+                    chunksizes = self._get_timeseries_chunksizes(variable, normalized_dimensions)
+                target_variable = target.createVariable(ds_var, variable.dtype, variable.dimensions,
+                                                        zlib=True, complevel=4, chunksizes=chunksizes,
+                                                        fill_value=NcfUtils.try_get_attr(variable, '_FillValue'))
+                target_variable.set_auto_maskandscale(False)
+                target_variable.setncatts({attr: variable.getncattr(attr) for attr in variable.ncattrs()
+                                           if attr != '_FillValue'})
+                if is_dimension:
+                    target_variable[:] = variable[:]
+                else:
+                    self._copy_variable_by_latitude_band(variable, target_variable, normalized_dimensions)
+                variable.set_auto_maskandscale(True)
+        finally:
+            target.close()
+        os.replace(temporary_path, target_path)
+        return target_path
+
+    def _get_timeseries_chunksizes(self, variable, normalized_dimensions):
+        """时间维整体作为一个 chunk，深度维为 1，经纬度按 TIMESERIES_CHUNK_BYTES 均分"""
+        time_size = variable.shape[normalized_dimensions.index('time')]
+        spatial_elements = max(1, self.TIMESERIES_CHUNK_BYTES // (time_size * variable.dtype.itemsize))
+        spatial_chunk = max(1, int(math.sqrt(spatial_elements)))
+        chunksizes = []
+        for dim, size in zip(normalized_dimensions, variable.shape):
+            if dim == 'time':
+                chunksizes.append(size)
+            elif dim in ('latitude', 'longitude'):
+                chunksizes.append(min(size, spatial_chunk))
+            else:
+                chunksizes.append(1)
+        return chunksizes
+
+    def _copy_variable_by_latitude_band(self, variable, target_variable, normalized_dimensions):
+        """按纬度带复制数据，每次复制的纬度带对齐副本的 chunk，且占用内存不超过 TIMESERIES_COPY_BYTES"""
+        latitude_axis = normalized_dimensions.index('latitude')
+        latitude_size = variable.shape[latitude_axis]
+        latitude_chunk = target_variable.chunking()[latitude_axis]
+        row_bytes = variable.dtype.itemsize * int(np.prod(variable.shape)) // max(1, latitude_size)
+        band = max(1, self.TIMESERIES_COPY_BYTES // max(1, row_bytes * latitude_chunk)) * latitude_chunk
+        for band_start in range(0, latitude_size, band):
+            slices = [slice(None)] * len(variable.shape)
+            slices[latitude_axis] = slice(band_start, min(band_start + band, latitude_size))
+            target_variable[tuple(slices)] = variable[tuple(slices)]
+
+    def get_1d_vq_data_batch(self, label=None, longitude_indices=None, latitude_indices=None, depth_index=None,
+                             fill_value=None, replace_value=None):
+        """
+        读取覆盖所有点的最小经纬度范围，再通过下标取出每个点的时间序列。
+        范围内的数据量超过 MAX_BULK_READ_SIZE 时按时间分块读取，每块读取后立即取出各点的数据，
+        内存中不会保留整个范围。
+        :return: 第一维为点，其余维度与 get_1d_vq_data 的返回值一致
+        """
+        longitude_indices = np.asarray(longitude_indices)
+        latitude_indices = np.asarray(latitude_indices)
+        longitude_start, longitude_end = int(longitude_indices.min()), int(longitude_indices.max())
+        latitude_start, latitude_end = int(latitude_indices.min()), int(latitude_indices.max())
+        bounding_size = (longitude_end - longitude_start + 1) * (latitude_end - latitude_start + 1)
+        if bounding_size > self.VQ_BOUNDING_SIZE_LIMIT and len(longitude_indices) > 1:
+            # 点分布过于分散时，读取整个范围反而更慢，逐点读取
+            data_arrays, read_stats = [], []
+            for longitude_index, latitude_index in zip(longitude_indices, latitude_indices):
+                data_arrays.append(self.get_1d_vq_data(label, longitude_index=int(longitude_index),
+                                                       latitude_index=int(latitude_index),
+                                                       time_index=None, depth_index=depth_index))
+                read_stats.append(self.last_read_stats)
+            data_array = np.stack(data_arrays)
+            self.last_read_stats = self._merge_read_stats(read_stats)
+        else:
+            variable = self.variables.get(label)
+            slice_dict = {
+                'longitude': slice(longitude_start, longitude_end + 1),
+                'latitude': slice(latitude_start, latitude_end + 1),
+                'time': slice(None),
+                'depth': depth_index if depth_index is not None else slice(None),
+            }
+            remaining_dimensions, time_length, bytes_per_time = [], 1, variable.dtype.itemsize
+            for dimension, size in zip(variable.dimensions, variable.shape):
+                normalized_dimension = NcfUtils.normalized_dimension(dimension)
+                sl = slice_dict.get(normalized_dimension)
+                if not isinstance(sl, slice):
+                    continue
+                remaining_dimensions.append(normalized_dimension)
+                if normalized_dimension == 'time':
+                    time_length = size
+                else:
+                    bytes_per_time *= len(range(*sl.indices(size)))
+            # 每块读取的时间步数，保证单次读取的数据量不超过 MAX_BULK_READ_SIZE
+            time_block = max(1, self.MAX_BULK_READ_SIZE // bytes_per_time) if 'time' in remaining_dimensions \
+                else time_length
+            # 取出各点后，时间维在结果中的位置（第一维为点）
+            point_dimensions = [dim for dim in remaining_dimensions if dim not in ('latitude', 'longitude')]
+            time_axis = 1 + point_dimensions.index('time') if 'time' in point_dimensions else None
+            data_arrays, read_stats = [], []
+            for time_start in range(0, time_length, time_block):
+                if time_axis is not None:
+                    slice_dict['time'] = slice(time_start, min(time_start + time_block, time_length))
+                block = self.read_hyperslab(label, slice_dict, use_timeseries_store=True)
+                read_stats.append(self.last_read_stats)
+                # adjust to [..., latitude, longitude]
+                block = np.moveaxis(block,
+                                    [remaining_dimensions.index('latitude'), remaining_dimensions.index('longitude')],
+                                    [-2, -1])
+                block = block[..., latitude_indices - latitude_start, longitude_indices - longitude_start]
+                data_arrays.append(np.moveaxis(block, -1, 0).astype(np.float64))
+            data_array = data_arrays[0] if len(data_arrays) == 1 else np.concatenate(data_arrays, axis=time_axis)
+            self.last_read_stats = self._merge_read_stats(read_stats)
+
+        if (fill_value is not None) and (replace_value is not None):
+            data_array[data_array == fill_value] = replace_value
+        return data_array
+
+    @staticmethod
+    def _merge_read_stats(read_stats):
+        """合并多次 read_hyperslab 的读取统计"""
+        return {
+            'chunking': read_stats[0]['chunking'],
+            'chunks': None if read_stats[0]['chunks'] is None else sum(st['chunks'] for st in read_stats),
+            'blocks': sum(st['blocks'] for st in read_stats),
+            'bytes_decompressed_estimate': sum(st['bytes_decompressed_estimate'] for st in read_stats),
+        }
+
     def get_date_data_list(self):
         date_data = [NcfUtils.convert_timestamp_to_datetime(self.since_timestamp +
                                                             value * NcfUtils.TIMEUNITS.get(self.time_units))
@@ -362,19 +819,35 @@ class NcfCore(SKLECBaseCore):
         return date_data
 
     def get_vqdata_content(self, label=None, longitude_value=None, latitude_value=None, depth_value=None):
+        vq_data = self.get_vqdata_content_batch(label=label, lat_lngs=[(latitude_value, longitude_value)],
+                                                depth_value=depth_value)
+        return {
+            'date_data': vq_data['date_data'],
+            'stream_data': vq_data['stream_data'][0],
+        }
+
+    def get_vqdata_content_batch(self, label=None, lat_lngs=None, depth_value=None):
+        """
+        获取多个点的时间序列，所有点共用一次读取与一份时间轴。
+        :param lat_lngs: [(latitude, longitude), ...]
+        """
         # 深度参数暂时弃用，固定为最浅层
-        longitude_index = NcfUtils.get_idx_from_sorted_list(longitude_value,
-                                                            self.dimension_fields.get('longitude').value[:].tolist())
-        latitude_index = NcfUtils.get_idx_from_sorted_list(latitude_value,
-                                                           self.dimension_fields.get('latitude').value[:].tolist())
+        lat_lngs = np.asarray(lat_lngs, dtype=np.float64).reshape(-1, 2)
+        longitude_indices = NcfUtils.get_idx_from_sorted_array(lat_lngs[:, 1],
+                                                               self.dimension_fields.get('longitude').value[:],
+                                                               name='longitude')
+        latitude_indices = NcfUtils.get_idx_from_sorted_array(lat_lngs[:, 0],
+                                                              self.dimension_fields.get('latitude').value[:],
+                                                              name='latitude')
         fill_value = float(getattr(self.variables.get(label), '_FillValue'))
         replace_value = 0
-        data_array = self.get_1d_vq_data(label, longitude_index=longitude_index, latitude_index=latitude_index,
-                                         time_index=None, depth_index=0,
-                                         fill_value=fill_value, replace_value=replace_value)
+        data_array = self.get_1d_vq_data_batch(label, longitude_indices=longitude_indices,
+                                               latitude_indices=latitude_indices, depth_index=0,
+                                               fill_value=fill_value, replace_value=replace_value)
         return {
             'date_data': self.get_date_data_list(),
             'stream_data': data_array.tolist(),
+            'read_stats': self.last_read_stats,
         }
 
     def get_2d_area_data(self, label=None, longitude_start=None, longitude_end=None,
@@ -392,7 +865,8 @@ class NcfCore(SKLECBaseCore):
         for dimension in self.variables.get(label).dimensions:
             normalized_dimension = NcfUtils.normalized_dimension(dimension)
             slices.append(slice_dict.get(normalized_dimension))
-        data_array = np.asarray(self.variables.get(label)[slices]).astype(np.float)
+        with self.read_lock:
+            data_array = np.asarray(self.variables.get(label)[slices]).astype(np.float)
 
         # adjust to [latitude, longitude]
         if self.variable_fields.get(label).normalized_dimensions.index('latitude') > \
@@ -404,25 +878,109 @@ class NcfCore(SKLECBaseCore):
             data_array[fill_pos] = replace_value
         return data_array
 
+    def get_2d_area_views(self, label=None, longitude_start=None, longitude_end=None,
+                          latitude_start=None, latitude_end=None, time_range=None, depth_range=None):
+        """
+        一次读取多个切片共同覆盖的 [time, depth, latitude, longitude] 块，每个 chunk 只解压一次。
+        time_range / depth_range 为 get_down_sampling_range 返回的等差 range，不存在该维度时传入 None。
+        返回 (time_index, depth_index) -> [latitude, longitude] 视图；数据量超过 MAX_BULK_READ_SIZE 时返回 None
+        """
+        variable = self.variables.get(label)
+        normalized_dimensions = self.variable_fields.get(label).normalized_dimensions
+        ranges = {
+            'longitude': range(longitude_start, longitude_end + 1),
+            'latitude': range(latitude_start, latitude_end + 1),
+            'time': time_range,
+            'depth': depth_range,
+        }
+        block_size = variable.dtype.itemsize
+        for dim in normalized_dimensions:
+            if ranges.get(dim) is not None:
+                block_size *= len(ranges.get(dim))
+        if block_size > self.MAX_BULK_READ_SIZE:
+            return None
+
+        slice_dict = {dim: slice(r.start, r.stop, r.step) for dim, r in ranges.items() if r is not None}
+        block = self.read_hyperslab(label, slice_dict)
+        if normalized_dimensions.index('latitude') > normalized_dimensions.index('longitude'):
+            block = np.swapaxes(block,
+                                normalized_dimensions.index('latitude'), normalized_dimensions.index('longitude'))
+
+        area_views = {}
+        for time_index in (time_range if time_range is not None else [None]):
+            for depth_index in (depth_range if depth_range is not None else [None]):
+                indices = {dim: slice(None) for dim in ('longitude', 'latitude')}
+                if time_index is not None:
+                    indices['time'] = (time_index - time_range.start) // time_range.step
+                if depth_index is not None:
+                    indices['depth'] = (depth_index - depth_range.start) // depth_range.step
+                area_views[(time_index, depth_index)] = block[tuple(indices.get(dim) for dim in normalized_dimensions)]
+        return area_views
+
     def generate_tiff(self, label,
                       longitude_start=None, longitude_end=None,
                       latitude_start=None, latitude_end=None,
                       time_index=None, depth_index=None,
-                      res_limit=None):
+                      res_limit=None, cog=False):
+        cache_key = self.gen_tiff_cache_key(label=label,
+                                            longitude_start=longitude_start, longitude_end=longitude_end,
+                                            latitude_start=latitude_start, latitude_end=latitude_end,
+                                            time_index=time_index, depth_index=depth_index,
+                                            res_limit=res_limit, cog=cog)
+        tiff_meta = NcfCacheManager.get_cached_tiff_meta(cache_key)
+        if tiff_meta is not None:
+            return tiff_meta
+
+        tiff_meta = self.render_tiff(cache_key, label=label,
+                                     longitude_start=longitude_start, longitude_end=longitude_end,
+                                     latitude_start=latitude_start, latitude_end=latitude_end,
+                                     time_index=time_index, depth_index=depth_index,
+                                     res_limit=res_limit, cog=cog)
+        NcfCacheManager.save_cached_tiff_meta(cache_key, tiff_meta)
+        return tiff_meta
+
+    def gen_tiff_cache_key(self, label, longitude_start, longitude_end, latitude_start, latitude_end,
+                           time_index, depth_index, res_limit, cog=False):
+        return NcfUtils.gen_cache_key(self.file_signature, label=label,
+                                      longitude_start=longitude_start, longitude_end=longitude_end,
+                                      latitude_start=latitude_start, latitude_end=latitude_end,
+                                      time_index=time_index, depth_index=depth_index,
+                                      res_limit=res_limit, cog=cog)
+
+    def render_tiff(self, cache_key, label,
+                    longitude_start=None, longitude_end=None,
+                    latitude_start=None, latitude_end=None,
+                    time_index=None, depth_index=None,
+                    res_limit=None, area_view=None, cog=False):
+        """
+        生成 tiff 文件并返回 tiff_meta。不访问数据库，可在工作线程中调用，由调用方负责登记缓存
+        :param area_view: get_2d_area_views 返回的 [latitude, longitude] 视图，给出时不再单独读取
+        :param cog: 是否输出带内部金字塔的 COG
+        """
         fill_value = float(getattr(self.variables.get(label), '_FillValue'))
         replace_value = NcfUtils.REPLACE_VALUE
-        data_array = self.get_2d_area_data(label=label,
-                                           longitude_start=longitude_start, longitude_end=longitude_end,
-                                           latitude_start=latitude_start, latitude_end=latitude_end,
-                                           time_index=time_index, depth_index=depth_index,
-                                           fill_value=fill_value, replace_value=replace_value)
-        lon_list = self.dimension_fields.get('longitude').value[slice(longitude_start, longitude_end + 1)]
-        lat_list = self.dimension_fields.get('latitude').value[slice(latitude_start, latitude_end + 1)]
-        tiff_name = "{}.tiff".format(NcfUtils.uuid4_short())
+        if area_view is not None:
+            data_array = area_view.astype(np.float64)
+            data_array[data_array == fill_value] = replace_value
+        with self.read_lock:
+            if area_view is None:
+                data_array = self.get_2d_area_data(label=label,
+                                                   longitude_start=longitude_start, longitude_end=longitude_end,
+                                                   latitude_start=latitude_start, latitude_end=latitude_end,
+                                                   time_index=time_index, depth_index=depth_index,
+                                                   fill_value=fill_value, replace_value=replace_value)
+            lon_list = self.dimension_fields.get('longitude').value[slice(longitude_start, longitude_end + 1)]
+            lat_list = self.dimension_fields.get('latitude').value[slice(latitude_start, latitude_end + 1)]
+            time_value = self.dimension_fields.get('time').value[time_index] if time_index is not None else None
+        tiff_name = "{}.tiff".format(cache_key)
         tiff_path = os.path.join(NcfUtils.CACHE_FOLDER_DIR, tiff_name)
-        NcfUtils.initialize_tiff(data_array=data_array,
-                                 lon_list=lon_list, lat_list=lat_list,
-                                 tiff_path=tiff_path, driver_name='GTiff', flush=True)
+        # 先写入临时文件再重命名，避免并发请求同一切片时互相覆盖
+        temporary_tiff_path = os.path.join(NcfUtils.CACHE_FOLDER_DIR,
+                                           "{}_{}.tiff".format(cache_key, NcfUtils.uuid4_short()))
+        # 原始栅格只在内存中构建，压缩后的结果是唯一落盘的文件
+        src_tiff = NcfUtils.initialize_tiff(data_array=data_array,
+                                            lon_list=lon_list, lat_list=lat_list,
+                                            tiff_path='', driver_name='MEM', flush=False)
 
         if res_limit is not None:
             down_sampling_width, down_sampling_height = NcfUtils.get_down_sampling_2d(total_dim1=len(lon_list),
@@ -430,19 +988,16 @@ class NcfCore(SKLECBaseCore):
                                                                                       limit=res_limit)
         else:
             down_sampling_width, down_sampling_height = 0, 0
-        NcfUtils.warp_tiff(tiff_path=tiff_path, warp_epsg=4326,
-                           tiled=True, compress='Deflate', predictor=1,
-                           width=down_sampling_width, height=down_sampling_height)
+        dest_tiff = NcfUtils.warp_tiff(tiff_path=temporary_tiff_path, src_tiff=src_tiff, warp_epsg=4326,
+                                       tiled=True, compress='Deflate', predictor=1,
+                                       width=down_sampling_width, height=down_sampling_height, cog=cog)
+        dest_tiff = None  # 关闭文件，写入磁盘
+        src_tiff = None
+        os.replace(temporary_tiff_path, tiff_path)
 
         min_value, max_value = NcfUtils.get_min_max_value(data_array=data_array, replace_value=replace_value)
 
-        if (self.since_timestamp is not None) and (self.time_units is not None):
-            display_name = '时间: ' + NcfUtils.convert_timestamp_to_datetime(
-                self.since_timestamp +
-                NcfUtils.TIMEUNITS.get(self.time_units) * self.dimension_fields.get('time').value[time_index]
-            ).strftime('%Y-%m-%d %T')
-        else:
-            display_name = 'GenericDisplayName'
+        display_name = self.get_display_name(time_value)
         tiff_meta = {
             'file': tiff_path,
             'file_path': tiff_path,
@@ -461,16 +1016,132 @@ class NcfCore(SKLECBaseCore):
             'max_value': max_value,
             'display_name': display_name,
             'res_limit': res_limit,
+            'cog': cog,
         }
         return tiff_meta
 
-    def generate_ncf_content(self, label,
-                             longitude_start=None, longitude_end=None,
-                             latitude_start=None, latitude_end=None,
-                             time_start=None, time_end=None,
-                             depth_start=None, depth_end=None,
-                             res_limit=None, filenum_limit=None,
-                             *args, **kwargs):
+    @classmethod
+    def get_xyz_tile_bounds(cls, z, x, y):
+        """XYZ 瓦片在 EPSG:3857 下的范围 (minx, miny, maxx, maxy)，以及对应的经纬度范围"""
+        tile_span = 2 * cls.WEB_MERCATOR_ORIGIN / (2 ** z)
+        minx = -cls.WEB_MERCATOR_ORIGIN + x * tile_span
+        maxy = cls.WEB_MERCATOR_ORIGIN - y * tile_span
+        bounds = (minx, maxy - tile_span, minx + tile_span, maxy)
+
+        def to_lon(mx):
+            return mx / cls.WEB_MERCATOR_ORIGIN * 180
+
+        def to_lat(my):
+            return math.degrees(math.atan(math.sinh(my / cls.WEB_MERCATOR_ORIGIN * math.pi)))
+
+        return bounds, (to_lon(bounds[0]), to_lat(bounds[1]), to_lon(bounds[2]), to_lat(bounds[3]))
+
+    def generate_xyz_tile(self, label, z, x, y, time_index=None, depth_index=None):
+        """
+        按需生成 XYZ（EPSG:3857）瓦片，只读取瓦片覆盖的窗口，每个瓦片单独缓存。
+        瓦片与数据范围不相交时返回 None
+        """
+        assert label in self.variables.keys(), f'Label {label} is not included in file.'
+        assert 0 <= x < 2 ** z and 0 <= y < 2 ** z, f'Tile ({z}, {x}, {y}) out of range.'
+        # 未指定时间、深度时取第一个切片
+        time_index = NcfUtils.convert_params_index_valid(index=time_index,
+                                                         exists=self.dimension_fields.get('time').exists,
+                                                         size=self.dimension_fields.get('time').size, name='time')
+        depth_index = NcfUtils.convert_params_index_valid(index=depth_index,
+                                                          exists=self.dimension_fields.get('depth').exists,
+                                                          size=self.dimension_fields.get('depth').size, name='depth')
+        time_index = time_index if self.dimension_fields.get('time').exists else None
+        depth_index = depth_index if self.dimension_fields.get('depth').exists else None
+
+        cache_key = NcfUtils.gen_cache_key(self.file_signature, tile='xyz', label=label, z=z, x=x, y=y,
+                                           time_index=time_index, depth_index=depth_index)
+        tiff_meta = NcfCacheManager.get_cached_tiff_meta(cache_key)
+        if tiff_meta is not None:
+            return tiff_meta
+
+        bounds, (lon_min, lat_min, lon_max, lat_max) = self.get_xyz_tile_bounds(z, x, y)
+        with self.read_lock:
+            lon_values = np.asarray(self.dimension_fields.get('longitude').value[:], dtype=np.float64)
+            lat_values = np.asarray(self.dimension_fields.get('latitude').value[:], dtype=np.float64)
+        if lon_max < lon_values[0] or lon_min > lon_values[-1] or lat_max < lat_values[0] or lat_min > lat_values[-1]:
+            return None
+        # 窗口向外多取一个格点，保证瓦片边缘可以插值，且每个方向至少两个格点
+        longitude_start = max(0, int(np.searchsorted(lon_values, lon_min, side='right')) - 2)
+        longitude_end = min(len(lon_values) - 1, max(int(np.searchsorted(lon_values, lon_max)) + 1,
+                                                     longitude_start + 1))
+        latitude_start = max(0, int(np.searchsorted(lat_values, lat_min, side='right')) - 2)
+        latitude_end = min(len(lat_values) - 1, max(int(np.searchsorted(lat_values, lat_max)) + 1,
+                                                    latitude_start + 1))
+
+        fill_value = float(getattr(self.variables.get(label), '_FillValue'))
+        replace_value = NcfUtils.REPLACE_VALUE
+        data_array = self.get_2d_area_data(label=label,
+                                           longitude_start=longitude_start, longitude_end=longitude_end,
+                                           latitude_start=latitude_start, latitude_end=latitude_end,
+                                           time_index=time_index, depth_index=depth_index,
+                                           fill_value=fill_value, replace_value=replace_value)
+        tiff_name = "{}.tiff".format(cache_key)
+        tiff_path = os.path.join(NcfUtils.CACHE_FOLDER_DIR, tiff_name)
+        temporary_tiff_path = os.path.join(NcfUtils.CACHE_FOLDER_DIR,
+                                           "{}_{}.tiff".format(cache_key, NcfUtils.uuid4_short()))
+        src_tiff = NcfUtils.initialize_tiff(data_array=data_array,
+                                            lon_list=lon_values[longitude_start:longitude_end + 1],
+                                            lat_list=lat_values[latitude_start:latitude_end + 1],
+                                            tiff_path='', driver_name='MEM', flush=False)
+        dest_tiff = NcfUtils.warp_tiff(tiff_path=temporary_tiff_path, src_tiff=src_tiff, warp_epsg=4326,
+                                       tiled=True, compress='Deflate', predictor=1,
+                                       width=self.TILE_SIZE, height=self.TILE_SIZE,
+                                       dst_epsg=3857, output_bounds=bounds, nodata=replace_value)
+        dest_tiff = None  # 关闭文件，写入磁盘
+        src_tiff = None
+        os.replace(temporary_tiff_path, tiff_path)
+
+        min_value, max_value = NcfUtils.get_min_max_value(data_array=data_array, replace_value=replace_value)
+        with self.read_lock:
+            time_value = self.dimension_fields.get('time').value[time_index] if time_index is not None else None
+        tiff_meta = {
+            'file': tiff_path,
+            'file_path': tiff_path,
+            'file_name': tiff_name,
+            'file_size': os.path.getsize(tiff_path),
+            'label': label,
+            'z': z,
+            'x': x,
+            'y': y,
+            'longitude_start': longitude_start,
+            'longitude_end': longitude_end,
+            'latitude_start': latitude_start,
+            'latitude_end': latitude_end,
+            'time_index': time_index,
+            'depth_index': depth_index,
+            'fill_value': fill_value,
+            'replace_value': replace_value,
+            'min_value': min_value,
+            'max_value': max_value,
+            'display_name': self.get_display_name(time_value),
+        }
+        NcfCacheManager.save_cached_tiff_meta(cache_key, tiff_meta)
+        NcfCacheManager.schedule_eliminate_cache()
+        return tiff_meta
+
+    def get_display_name(self, time_value):
+        if (self.since_timestamp is not None) and (self.time_units is not None) and (time_value is not None):
+            return '时间: ' + NcfUtils.convert_timestamp_to_datetime(
+                self.since_timestamp +
+                NcfUtils.TIMEUNITS.get(self.time_units) * time_value
+            ).strftime('%Y-%m-%d %T')
+        return 'GenericDisplayName'
+
+    def _get_content_slices(self, label,
+                            longitude_start=None, longitude_end=None,
+                            latitude_start=None, latitude_end=None,
+                            time_start=None, time_end=None,
+                            depth_start=None, depth_end=None,
+                            res_limit=None, filenum_limit=None):
+        """
+        校验请求参数，返回经纬度范围 (longitude_start, longitude_end, latitude_start, latitude_end)
+        以及按 filenum_limit 降采样后的时间、深度下标 range（不存在该维度时为 None）
+        """
         assert label in self.variables.keys(), f'Label {label} is not included in file.'
         assert NcfUtils.check_lat_lng_exists(self.variables.get(label).dimensions), \
             f'Dimensions of label {label} are invalid.'
@@ -513,21 +1184,149 @@ class NcfCore(SKLECBaseCore):
         else:
             down_sampling_time, down_sampling_depth = time_length, depth_length
 
-        NcfCacheManager.eliminate_cache()
-        ncf_content = []
-        for time_index in NcfUtils.get_down_sampling_range(time_length, down_sampling_time):
-            for depth_index in NcfUtils.get_down_sampling_range(depth_length, down_sampling_depth):
-                tiff_info = self.generate_tiff(
-                    label=label,
-                    longitude_start=longitude_start, longitude_end=longitude_end,
-                    latitude_start=latitude_start, latitude_end=latitude_end,
-                    time_index=time_index if self.dimension_fields.get('time').exists else None,
-                    depth_index=depth_index if self.dimension_fields.get('depth').exists else None,
-                    res_limit=res_limit
-                )
-                ncf_content.append(tiff_info)
+        time_range = NcfUtils.get_down_sampling_range(time_length, down_sampling_time)
+        depth_range = NcfUtils.get_down_sampling_range(depth_length, down_sampling_depth)
+        return (longitude_start, longitude_end, latitude_start, latitude_end,
+                time_range if self.dimension_fields.get('time').exists else None,
+                depth_range if self.dimension_fields.get('depth').exists else None)
+
+    def generate_ncf_content(self, label,
+                             longitude_start=None, longitude_end=None,
+                             latitude_start=None, latitude_end=None,
+                             time_start=None, time_end=None,
+                             depth_start=None, depth_end=None,
+                             res_limit=None, filenum_limit=None,
+                             max_workers=settings.NCF_TIFF_WORKERS, cog=False,
+                             *args, **kwargs):
+        longitude_start, longitude_end, latitude_start, latitude_end, time_range, depth_range = \
+            self._get_content_slices(label=label,
+                                     longitude_start=longitude_start, longitude_end=longitude_end,
+                                     latitude_start=latitude_start, latitude_end=latitude_end,
+                                     time_start=time_start, time_end=time_end,
+                                     depth_start=depth_start, depth_end=depth_end,
+                                     res_limit=res_limit, filenum_limit=filenum_limit)
+
+        NcfCacheManager.schedule_eliminate_cache()
+        tiff_params = []
+        for time_index in (time_range if time_range is not None else [None]):
+            for depth_index in (depth_range if depth_range is not None else [None]):
+                tiff_params.append({
+                    'label': label,
+                    'longitude_start': longitude_start, 'longitude_end': longitude_end,
+                    'latitude_start': latitude_start, 'latitude_end': latitude_end,
+                    'time_index': time_index,
+                    'depth_index': depth_index,
+                    'res_limit': res_limit,
+                    'cog': cog,
+                })
+
+        # 缓存的查找与登记只在当前线程中进行，工作线程只负责生成 tiff
+        cache_keys = [self.gen_tiff_cache_key(**params) for params in tiff_params]
+        ncf_content = [NcfCacheManager.get_cached_tiff_meta(cache_key) for cache_key in cache_keys]
+        missed = [i for i, tiff_info in enumerate(ncf_content) if tiff_info is None]
+
+        # 多个切片未命中时一次读取整个数据块，各切片共享同一块内存
+        area_views = None
+        if len(missed) > 1:
+            area_views = self.get_2d_area_views(
+                label=label,
+                longitude_start=longitude_start, longitude_end=longitude_end,
+                latitude_start=latitude_start, latitude_end=latitude_end,
+                time_range=time_range, depth_range=depth_range)
+
+        def render(i):
+            area_view = None
+            if area_views is not None:
+                area_view = area_views.get((tiff_params[i].get('time_index'), tiff_params[i].get('depth_index')))
+            return self.render_tiff(cache_keys[i], area_view=area_view, **tiff_params[i])
+
+        workers = min(max_workers or 1, len(missed))
+        if workers > 1:
+            with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='NcfTiffWorker') as executor:
+                rendered = list(executor.map(render, missed))
+        else:
+            rendered = [render(i) for i in missed]
+        for i, tiff_info in zip(missed, rendered):
+            NcfCacheManager.save_cached_tiff_meta(cache_keys[i], tiff_info)
+            ncf_content[i] = tiff_info
         return ncf_content
 
+    def generate_ncf_arrays(self, label,
+                            longitude_start=None, longitude_end=None,
+                            latitude_start=None, latitude_end=None,
+                            time_start=None, time_end=None,
+                            depth_start=None, depth_end=None,
+                            res_limit=None, filenum_limit=None,
+                            dtype='float32',
+                            *args, **kwargs):
+        """
+        与 generate_ncf_content 参数相同，但不生成 tiff，而是按切片顺序依次产出 (header, data_array)。
+        data_array 为 [latitude, longitude] 的 dtype 数组，缺测值为 NaN；res_limit 通过等间隔抽取格点实现。
+        参数校验在第一次迭代前完成。
+        """
+        longitude_start, longitude_end, latitude_start, latitude_end, time_range, depth_range = \
+            self._get_content_slices(label=label,
+                                     longitude_start=longitude_start, longitude_end=longitude_end,
+                                     latitude_start=latitude_start, latitude_end=latitude_end,
+                                     time_start=time_start, time_end=time_end,
+                                     depth_start=depth_start, depth_end=depth_end,
+                                     res_limit=res_limit, filenum_limit=filenum_limit)
+        assert dtype in NcfUtils.ARRAY_FRAME_DTYPES, f'dtype {dtype} is not supported.'
+        return self._generate_ncf_arrays(label, longitude_start, longitude_end, latitude_start, latitude_end,
+                                         time_range, depth_range, res_limit, dtype)
+
+    def _generate_ncf_arrays(self, label, longitude_start, longitude_end, latitude_start, latitude_end,
+                             time_range, depth_range, res_limit, dtype):
+        fill_value = float(getattr(self.variables.get(label), '_FillValue'))
+        longitude_length = longitude_end - longitude_start + 1
+        latitude_length = latitude_end - latitude_start + 1
+        stride = 1
+        if res_limit is not None and longitude_length * latitude_length > res_limit:
+            stride = math.ceil(math.sqrt(longitude_length * latitude_length / res_limit))
+        with self.read_lock:
+            lon_list = np.asarray(self.dimension_fields.get('longitude').value[
+                                      slice(longitude_start, longitude_end + 1, stride)], dtype=np.float64)
+            lat_list = np.asarray(self.dimension_fields.get('latitude').value[
+                                      slice(latitude_start, latitude_end + 1, stride)], dtype=np.float64)
+        area_views = self.get_2d_area_views(label=label,
+                                            longitude_start=longitude_start, longitude_end=longitude_end,
+                                            latitude_start=latitude_start, latitude_end=latitude_end,
+                                            time_range=time_range, depth_range=depth_range)
+
+        for time_index in (time_range if time_range is not None else [None]):
+            for depth_index in (depth_range if depth_range is not None else [None]):
+                if area_views is not None:
+                    area_view = area_views.get((time_index, depth_index))
+                else:
+                    area_view = self.get_2d_area_data(label=label,
+                                                      longitude_start=longitude_start, longitude_end=longitude_end,
+                                                      latitude_start=latitude_start, latitude_end=latitude_end,
+                                                      time_index=time_index, depth_index=depth_index)
+                data_array = np.asarray(area_view[::stride, ::stride], dtype=np.float32)
+                data_array[data_array == np.float32(fill_value)] = np.nan
+                valid = data_array[~np.isnan(data_array)]
+                with self.read_lock:
+                    time_value = self.dimension_fields.get('time').value[time_index] \
+                        if time_index is not None else None
+                header = {
+                    'label': label,
+                    'time_index': time_index,
+                    'depth_index': depth_index,
+                    'longitude_start': longitude_start,
+                    'longitude_end': longitude_end,
+                    'latitude_start': latitude_start,
+                    'latitude_end': latitude_end,
+                    'stride': stride,
+                    'longitude_min': float(lon_list.min()),
+                    'longitude_max': float(lon_list.max()),
+                    'latitude_min': float(lat_list.min()),
+                    'latitude_max': float(lat_list.max()),
+                    'min_value': float(valid.min()) if len(valid) > 0 else 0.0,
+                    'max_value': float(valid.max()) if len(valid) > 0 else 0.0,
+                    'display_name': self.get_display_name(time_value),
+                }
+                yield header, data_array.astype(NcfUtils.ARRAY_FRAME_DTYPES.get(dtype))
+
     def generate_thumbnail_for_label(self, label):
         pass
 
@@ -591,10 +1390,13 @@ class NcfCore(SKLECBaseCore):
             info['date_data'] = []
         return info
 
-    def save_visfile_and_rawfile_to_dataset(self, dataset_uuid) -> (str, str):
+    def save_visfile_and_rawfile_to_dataset(self, dataset_uuid,
+                                            gen_timeseries_store=settings.NCF_GEN_TIMESERIES_STORE) -> (str, str):
         """
         为指定 dataset 生成 visfile 和 rawfile
         :param dataset_uuid: 指定 dataset 的 uuid
+        :param gen_timeseries_store: 是否在后台线程中生成按时间维分块的副本，用于加速时间序列查询。
+            副本生成开销很大（见 generate_timeseries_store），不在上传请求中进行
         :return: (rawfile.uuid, visfile.uuid)
         """
         dataset = Dataset.objects.get(uuid=dataset_uuid)
@@ -617,8 +1419,27 @@ class NcfCore(SKLECBaseCore):
 
         visfile.save()
         rawfile.save()
+        if gen_timeseries_store:
+            self.schedule_timeseries_store(visfile.file.path)
         return rawfile.uuid, visfile.uuid
 
+    @classmethod
+    def schedule_timeseries_store(cls, filepath):
+        """在后台线程中为 filepath 生成时间序列副本，调用方不等待"""
+        cls._timeseries_store_executor.submit(cls._generate_timeseries_store_in_background, filepath)
+
+    @classmethod
+    def _generate_timeseries_store_in_background(cls, filepath):
+        try:
+            core = cls(filepath)
+            try:
+                target_path = core.generate_timeseries_store()
+            finally:
+                core.close()
+            print(f'Generate timeseries store {target_path} succeed.')
+        except Exception as e:
+            print(f'Generate timeseries store for {filepath} failed: {e.args}')
+
     def refresh_visfile(self, visfile_uuid):
         target_visfile = VisFile.objects.get(uuid=visfile_uuid)
         info = self.get_visfile_info()
@@ -627,6 +1448,15 @@ class NcfCore(SKLECBaseCore):
         target_visfile.save()
         return target_visfile.uuid
 
+    def close(self):
+        if self.timeseries_dataset is not None:
+            self.timeseries_dataset.close()
+        self.dataset.close()
+
+
+# 每个 worker 进程内复用已打开的 NcfCore，避免每次请求重新打开文件、解析维度与变量
+NCF_CORE_POOL = CorePool(NcfCore, max_size=8)
+
 
 class NcfCoreClass(SKLECBaseCore):
 
@@ -675,17 +1505,14 @@ class NcfCoreClass(SKLECBaseCore):
         return self.channels
 
     def _find_in_cache_folder(self, file_name):
-        for root, dirs, files in os.walk(CACHE_FOLDER_DIR):
-            for file in files:
-                if (not file.endswith('trans.tiff')):
-                    continue
-                if file.startswith(file_name):
-                    # 重新设置访问时间
-                    os.utime(os.path.join(root, file), times=None)
-                    return file
-
-        return None
-
+        entry = ViewTiffFile.objects.filter(is_preview=True, file_name__startswith=file_name,
+                                            file_name__endswith='trans.tiff').first()
+        if entry is None:
+            return None
+        # 重新设置访问时间
+        entry.last_access_time = timezone.now()
+        entry.save(update_fields=['last_access_time'])
+        return entry.file_name
 
     def gen_preview(self, channel_label, uuid):
         params = {}
@@ -857,6 +1684,23 @@ class NcfCoreClass(SKLECBaseCore):
                                                           )
                 gdal.Translate(translate_tif_path, warp_tif_path,
                                options=translate_options)
+                # 重新生成的预览覆盖同一文件，先删除该文件已有的条目（包括此前重复登记的），避免重复登记
+                ViewTiffFile.objects.filter(is_preview=True, file=translate_tif_path).delete()
+                ViewTiffFile.objects.create(is_preview=True,
+                                            file=translate_tif_path,
+                                            file_name=translate_tif_name,
+                                            file_size=os.path.getsize(translate_tif_path),
+                                            datetime=datetime,
+                                            depth=depth,
+                                            longitude_start=params['longitude_start'],
+                                            longitude_end=params['longitude_end'],
+                                            latitude_start=params['latitude_start'],
+                                            latitude_end=params['latitude_end'],
+                                            label=label,
+                                            min_value=float(min_value),
+                                            max_value=float(max_value),
+                                            create_time=timezone.now(),
+                                            last_access_time=timezone.now())
                 tiff_meta = {
                     'filepath': translate_tif_path,
                     'file_size': os.path.getsize(translate_tif_path),
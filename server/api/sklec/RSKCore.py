@@ -1,10 +1,18 @@
 import os.path
+import re
+import json
+import time
+import shutil
+import sqlite3
+import threading
+from collections import OrderedDict
 from typing import List
 import numpy as np
 import pyrsktools
 from pyrsktools import RSK
 from api.sklec.SKLECBaseCore import SKLECBaseCore
-from api.utils import downsample1d
+from api.sklec.utils import CorePool
+from api.utils import downsample_lttb_indices, StreamingM4Downsampler, StreamingStrideDownsampler
 import warnings
 
 class RSKCoreException:
@@ -13,6 +21,10 @@ class RSKCoreException:
 class RSKCore(SKLECBaseCore):
 
     TARGET_VIS_LENGTH: int = 2000
+    SAMPLE_CACHE_SIZE: int = 32
+    CHUNK_SIZE: int = 65536  # Rows per chunk read from the data table, must be a multiple of 16 for the pyramid
+    LTTB_PREAGGREGATION: int = 4  # LTTB runs on an M4 pre-aggregation of LTTB_PREAGGREGATION * target samples
+    TIMESTAMP_DTYPE = np.dtype('datetime64[ms]')  # tstamp of the data table is in milliseconds since epoch
 
     def __init__(self, file_path):
         self.file = RSK(file_path)
@@ -26,8 +38,25 @@ class RSKCore(SKLECBaseCore):
             # if channel in self.file.channels:
             self.channel_name[channel.shortName] = channel.longName
 
-        self.sample_cache = {}
-        print(self)
+        self.file_path = file_path
+        # LRU of recently served responses: (start_time, end_time, target_samples, ...) -> channel data
+        self.sample_cache = OrderedDict()
+        self.pyramid = RSKSummaryPyramid.load(file_path)
+        # Reads on the same core share one sqlite connection and the LRU, so they must be serialized
+        self.read_lock = threading.Lock()
+        self._reopen_connection()
+        # Channels having a column in the data table, and their columns
+        self.data_channels, self.data_columns = self._get_data_channels()
+
+    def _reopen_connection(self):
+        """pyRSKtools opens its sqlite connection with check_same_thread=True, but a pooled core is used (and
+        closed) from other threads than the one that opened it. Reopen it shareable; read_lock serializes it."""
+        connection = self.file._db
+        self.file._db = sqlite3.connect(f'file:{self.file_path}?mode=ro', uri=True, check_same_thread=False)
+        reader = getattr(self.file, '_reader', None)
+        if reader is not None and getattr(reader, '_db', None) is connection:
+            reader._db = self.file._db
+        connection.close()
 
     def __str__(self):
         return f'RSKCore: {self.name}' + \
@@ -79,14 +108,22 @@ class RSKCore(SKLECBaseCore):
             return {}
         return {target_key: all_channels[target_key]}
 
-    def get_all_channel_data(self, start_time, end_time, **kwargs):
+    def get_all_channel_data(self, start_time, end_time, time_format: str = 'iso', smooth_algorithm: str = None,
+                             target_samples: int = None, **kwargs):
         """Get all channel data from a RSK file.
+        The samples are read from the data table in bounded chunks and fed to a streaming downsampler, so the
+        memory used does not depend on the length of the range.
 
         Args:
             start_time (str | datetime.datetime): The start time. Optional, should be a
                 python datetime object or an ISO string **without** timezone.
             end_time (str | datetime.datetime): The end time. Optional, shoudl be Optional, should be a
                 python datetime object or an ISO string **without** timezone.
+            time_format (str): 'iso' for ISO strings, or 'epoch_ms' for milliseconds since epoch.
+            smooth_algorithm (str): Downsample algorithm, one of api.utils.DOWNSAMPLE_ALGORITHMS.
+                'm4' and 'lttb' keep the spikes. Default is 'm4' if the file has a summary pyramid (long ranges
+                are then answered from the pyramid), 'stride' otherwise.
+            target_samples (int): Number of samples to return. Default is TARGET_VIS_LENGTH.
         Returns:
             _type_: Return the channle data. Example:
             {
@@ -94,29 +131,432 @@ class RSKCore(SKLECBaseCore):
                 'temperature (temp09)': [1, 1, 1, 1...],
             }
         """
-        if start_time and end_time:
-            t1 = np.datetime64(start_time)
-            t2 = np.datetime64(end_time)
-            self.file.readdata(t1, t2)
-            total_samples = list(self.file.data)
+        target_samples = target_samples or self.TARGET_VIS_LENGTH
+        cache_key = (str(start_time), str(end_time), target_samples, time_format, smooth_algorithm)
+        with self.read_lock:
+            res = self.sample_cache.get(cache_key)
+            if res is not None:
+                self.sample_cache.move_to_end(cache_key)
+                return res
+            res = self._read_channel_data(start_time, end_time, time_format, smooth_algorithm, target_samples)
+            self.sample_cache[cache_key] = res
+            while len(self.sample_cache) > self.SAMPLE_CACHE_SIZE:
+                self.sample_cache.popitem(last=False)
+            return res
+
+    def _read_channel_data(self, start_time, end_time, time_format, smooth_algorithm, target_samples) -> dict:
+        if self.pyramid is None:
+            # The pyramid may have been built after this core was opened
+            self.pyramid = RSKSummaryPyramid.load(self.file_path)
+        if smooth_algorithm is None:
+            # Files with a summary pyramid default to m4, so that long ranges are answered from the pyramid and
+            # every zoom level gets the same layout; the others keep the cheaper stride
+            smooth_algorithm = 'm4' if self.pyramid is not None else 'stride'
+        if not (start_time and end_time):
+            start_time = end_time = None
+        if self.pyramid is not None and smooth_algorithm == 'm4':
+            summary = self._read_from_pyramid(start_time, end_time, target_samples)
+            if summary is not None:
+                times, values = summary
+                return self._columns_to_output(times.astype(self.TIMESTAMP_DTYPE), values.T, time_format)
+
+        channel_count = len(self.data_channels)
+        length = self.count_samples(start_time, end_time)
+        if length == 0:
+            return self._columns_to_output(np.empty(0, dtype=self.TIMESTAMP_DTYPE),
+                                           [np.empty(0)] * channel_count, time_format)
+        if smooth_algorithm == 'stride':
+            sampler = StreamingStrideDownsampler(length, target_samples)
+        elif smooth_algorithm == 'm4':
+            sampler = StreamingM4Downsampler(length, target_samples, channel_count)
+        elif smooth_algorithm == 'lttb':
+            sampler = StreamingM4Downsampler(length, self.LTTB_PREAGGREGATION * target_samples, channel_count)
         else:
-            self.file.readdata()
-            total_samples = list(self.file.data)
-        downsampled_samples = downsample1d(total_samples, self.TARGET_VIS_LENGTH)
-        res = {'Time': []}
-        channel_label_to_output_name = {'timestamp': 'Time'}
-        for channel in self.channels:
-            channel_label_to_output_name[channel.shortName] = self._gen_channel_key(channel)
-            res[channel_label_to_output_name[channel.shortName]] = []
-        for sample in downsampled_samples:
-            for i, item in enumerate(sample):
-                if i == 0:
-                    # item is a np.datetime64 type.
-                    res['Time'].append(np.datetime_as_string(item))
-                else:
-                    res[channel_label_to_output_name[self.channels[i - 1].shortName]].append(item)
+            raise ValueError(f'Downsample algorithm {smooth_algorithm} is not supported.')
+        for times, values in self.iter_data_chunks(start_time, end_time):
+            sampler.update(times, values)
+        times, values = sampler.result()
+        if smooth_algorithm == 'lttb':
+            indices = downsample_lttb_indices(times, values, target_samples)
+            times, values = times[indices], values[indices]
+        return self._columns_to_output(times.astype(self.TIMESTAMP_DTYPE), values.T, time_format)
+
+    def _read_from_pyramid(self, start_time, end_time, target_samples: int):
+        """
+        M4 of [start_time, end_time] from the summary pyramid, with the same layout as StreamingM4Downsampler.
+        Only the pyramid buckets lying entirely within the range are used; the samples of the range before the
+        first and after the last of them are read from the data table (less than two buckets), and so are the
+        target_samples % 4 samples that end the range.
+        :return: (tstamp in milliseconds, values of shape (samples, channels)), or None if the range holds too
+            few pyramid buckets, in which case the raw samples should be read instead.
+        """
+        group_count, tail_count = target_samples // 4, target_samples % 4
+        t_start = self._to_tstamp(start_time) if start_time is not None else None
+        t_end = self._to_tstamp(end_time) if end_time is not None else None
+        # One more bucket than groups, in case the last one has to give way to the tail samples
+        selection = self.pyramid.select_buckets(t_start, t_end, group_count + 1)
+        if selection is None:
+            return None
+        level, first, last = selection
+        head = self._read_samples(t_start, int(level['t_first'][first]) - 1)
+        tail = self._read_samples(int(level['t_last'][last - 1]) + 1, t_end)
+        if len(tail[0]) < tail_count:
+            last -= 1
+            tail = self._read_samples(int(level['t_last'][last - 1]) + 1, t_end)
+            if len(tail[0]) < tail_count:
+                return None
+        body_end = len(tail[0]) - tail_count
+        unit_parts = [RSKSummaryPyramid.samples_to_units(*head),
+                      self.pyramid.get_units(level, first, last),
+                      RSKSummaryPyramid.samples_to_units(tail[0][:body_end], tail[1][:body_end])]
+        units = {field: np.concatenate([part[field] for part in unit_parts])
+                 for field in RSKSummaryPyramid.UNIT_FIELDS}
+        summary = RSKSummaryPyramid.m4(units, group_count)
+        if summary is None:
+            return None
+        times, values = summary
+        return np.concatenate([times, tail[0][body_end:]]), np.concatenate([values, tail[1][body_end:]])
+
+    def _read_samples(self, t_start, t_end):
+        """Read all the samples with t_start <= tstamp <= t_end (in milliseconds, None for no bound)."""
+        start_time = np.datetime64(t_start, 'ms') if t_start is not None else None
+        end_time = np.datetime64(t_end, 'ms') if t_end is not None else None
+        chunks = list(self.iter_data_chunks(start_time, end_time))
+        if len(chunks) == 0:
+            return np.empty(0, dtype=np.int64), np.empty((0, len(self.data_channels)), dtype=np.float64)
+        return np.concatenate([chunk[0] for chunk in chunks]), np.concatenate([chunk[1] for chunk in chunks])
+
+    def _get_data_channels(self):
+        """As pyRSKtools does, match the channelNN columns of the data table with the channel IDs. Channels
+        without a data column are left out."""
+        columns = {}
+        for row in self.file._db.execute('PRAGMA table_info(data)'):
+            match = re.fullmatch(r'channel(\d+)', row[1])
+            if match is not None:
+                columns[int(match.group(1))] = row[1]
+        data_channels = [channel for channel in self.channels if channel.channelID in columns]
+        return data_channels, [columns[channel.channelID] for channel in data_channels]
+
+    def _get_data_columns(self) -> List[str]:
+        """Columns read from the data table: tstamp followed by one column per channel of self.data_channels."""
+        return ['tstamp'] + self.data_columns
+
+    def _to_tstamp(self, value) -> int:
+        return int(np.datetime64(value).astype(self.TIMESTAMP_DTYPE).astype(np.int64))
+
+    def _get_range_conditions(self, start_time, end_time):
+        """SQL conditions and parameters of the inclusive [start_time, end_time] range on tstamp. A bound that is
+        None is left out."""
+        conditions, params = [], []
+        if start_time is not None:
+            conditions.append('tstamp >= ?')
+            params.append(self._to_tstamp(start_time))
+        if end_time is not None:
+            conditions.append('tstamp <= ?')
+            params.append(self._to_tstamp(end_time))
+        return conditions, params
+
+    def count_samples(self, start_time=None, end_time=None) -> int:
+        """Number of samples in [start_time, end_time], or in the whole file if the range is not given."""
+        conditions, params = self._get_range_conditions(start_time, end_time)
+        where = f' WHERE {" AND ".join(conditions)}' if conditions else ''
+        return self.file._db.execute(f'SELECT COUNT(*) FROM data{where}', params).fetchone()[0]
+
+    def iter_data_chunks(self, start_time=None, end_time=None, chunk_size: int = None):
+        """Read the samples in [start_time, end_time] from the data table, chunk_size rows at a time.
+        Chunks are paginated on tstamp (keyset pagination, tstamp is the primary key of the data table), so each
+        query seeks the tstamp index instead of skipping the rows already read, and at most one chunk is held
+        in memory.
+
+        Args:
+            start_time (str | datetime.datetime): The start time. Optional.
+            end_time (str | datetime.datetime): The end time. Optional.
+            chunk_size (int): Rows per chunk. Default is CHUNK_SIZE.
+        Yields:
+            (np.ndarray, np.ndarray): tstamp in milliseconds (int64), and values of shape (rows, channels).
+        """
+        chunk_size = chunk_size or self.CHUNK_SIZE
+        columns = ', '.join(self._get_data_columns())
+        conditions, params = self._get_range_conditions(start_time, end_time)
+        last_tstamp = None
+        while True:
+            chunk_conditions, chunk_params = list(conditions), list(params)
+            if last_tstamp is not None:
+                chunk_conditions.append('tstamp > ?')
+                chunk_params.append(last_tstamp)
+            where = f' WHERE {" AND ".join(chunk_conditions)}' if chunk_conditions else ''
+            rows = self.file._db.execute(f'SELECT {columns} FROM data{where} ORDER BY tstamp LIMIT ?',
+                                         chunk_params + [chunk_size]).fetchall()
+            if len(rows) == 0:
+                return
+            times = np.fromiter((row[0] for row in rows), dtype=np.int64, count=len(rows))
+            # NULL values become nan
+            values = np.array([row[1:] for row in rows], dtype=np.float64).reshape(len(rows), -1)
+            yield times, values
+            if len(rows) < chunk_size:
+                return
+            last_tstamp = int(times[-1])
+
+    def _columns_to_output(self, timestamps: np.ndarray, columns: List[np.ndarray], time_format: str = 'iso') -> dict:
+        """Convert (downsampled) columns to the output dict, one column at a time."""
+        res = {'Time': self._format_timestamps(timestamps, time_format)}
+        for column, channel in zip(columns, self.data_channels):
+            res[self._gen_channel_key(channel)] = column.tolist()
         return res
 
+    @staticmethod
+    def _format_timestamps(timestamps: np.ndarray, time_format: str = 'iso') -> List:
+        if time_format == 'epoch_ms':
+            return timestamps.astype('datetime64[ms]').astype(np.int64).tolist()
+        return np.datetime_as_string(timestamps).tolist()
+
 
     def close(self):
-        self.file.close()
\ No newline at end of file
+        self.file.close()
+
+
+class RSKSummaryPyramid:
+    """
+    Multi-level summary of a RSK file, stored next to it in <file>.pyramid/.
+    Level i summarizes buckets of 2 ** (MIN_LEVEL + i) consecutive samples. For every bucket it stores the
+    first / last timestamps, the sample count, and per channel the count of non-NaN samples, min / max / mean,
+    whether the min comes before the max, and the first and last values. Each field is a memory-mapped .npy
+    file, so a query only touches the buckets it reads.
+    """
+
+    FOLDER_SUFFIX = '.pyramid'
+    META_FILE_NAME = 'meta.json'
+    FORMAT_VERSION = 3  # Pyramids written with another version are ignored and must be rebuilt
+    MIN_LEVEL = 4  # Finest level: buckets of 16 samples
+    MIN_BUCKETS = 256  # Stop building coarser levels once a level has fewer buckets than this
+    FIELDS = ['t_first', 't_last', 'count', 'valid_count', 'min', 'max', 'mean', 'min_first', 'first', 'last']
+
+    def __init__(self, folder: str, meta: dict):
+        self.folder = folder
+        self.meta = meta
+        self.timestamp_dtype = np.dtype(meta['timestamp_dtype'])
+        self.levels = [{field: np.load(os.path.join(folder, f'level{i}_{field}.npy'), mmap_mode='r')
+                        for field in self.FIELDS}
+                       for i in range(meta['level_count'])]
+
+    @classmethod
+    def get_folder(cls, file_path: str) -> str:
+        return file_path + cls.FOLDER_SUFFIX
+
+    @classmethod
+    def _get_file_signature(cls, file_path: str) -> dict:
+        stat = os.stat(file_path)
+        return {'mtime': stat.st_mtime_ns, 'size': stat.st_size}
+
+    @classmethod
+    def load(cls, file_path: str):
+        """
+        Load the pyramid of a RSK file.
+        :return: RSKSummaryPyramid, or None if it is missing, older than the file or of another format version.
+        """
+        meta_path = os.path.join(cls.get_folder(file_path), cls.META_FILE_NAME)
+        if not os.path.exists(meta_path):
+            return None
+        with open(meta_path, 'r') as f:
+            meta = json.load(f)
+        if meta.get('signature') != cls._get_file_signature(file_path) or \
+                meta.get('format_version') != cls.FORMAT_VERSION:
+            return None
+        return cls(cls.get_folder(file_path), meta)
+
+    @classmethod
+    def build(cls, core: 'RSKCore', file_path: str):
+        """
+        Build the pyramid of a RSK file. The files are written to a temporary folder and moved into place.
+        :return: RSKSummaryPyramid, or None if the file has no sample.
+        """
+        # Chunks hold a multiple of the bucket size, so every bucket but the last is complete within a chunk
+        chunk_size = max(1, core.CHUNK_SIZE // 2 ** cls.MIN_LEVEL) * 2 ** cls.MIN_LEVEL
+        chunks = [cls._summarize(times, values, 2 ** cls.MIN_LEVEL)
+                  for times, values in core.iter_data_chunks(chunk_size=chunk_size)]
+        if len(chunks) == 0:
+            print(f'{file_path} has no sample, skipping the pyramid.')
+            return None
+        levels = [{field: np.concatenate([chunk[field] for chunk in chunks]) for field in cls.FIELDS}]
+        timestamp_dtype = core.TIMESTAMP_DTYPE
+        while len(levels[-1]['count']) >= 2 * cls.MIN_BUCKETS:
+            levels.append(cls._merge(levels[-1]))
+        return cls._save(file_path, levels, timestamp_dtype)
+
+    @classmethod
+    def _save(cls, file_path: str, levels: List[dict], timestamp_dtype):
+        folder = cls.get_folder(file_path)
+        temporary_folder = f'{folder}.{os.getpid()}.{int(time.time())}'
+        os.makedirs(temporary_folder, exist_ok=True)
+        try:
+            for i, level in enumerate(levels):
+                for field in cls.FIELDS:
+                    np.save(os.path.join(temporary_folder, f'level{i}_{field}.npy'), level[field])
+            with open(os.path.join(temporary_folder, cls.META_FILE_NAME), 'w') as f:
+                json.dump({
+                    'signature': cls._get_file_signature(file_path),
+                    'timestamp_dtype': np.dtype(timestamp_dtype).str,
+                    'level_count': len(levels),
+                    'min_level': cls.MIN_LEVEL,
+                    'format_version': cls.FORMAT_VERSION,
+                }, f)
+            if os.path.exists(folder):
+                shutil.rmtree(folder)
+            os.replace(temporary_folder, folder)
+        finally:
+            if os.path.exists(temporary_folder):
+                shutil.rmtree(temporary_folder)
+        return cls.load(file_path)
+
+    @classmethod
+    def _summarize(cls, times: np.ndarray, values: np.ndarray, bucket_size: int) -> dict:
+        """Summarize raw samples into buckets of bucket_size samples (the last bucket may be smaller)."""
+        length = len(times)
+        starts = np.arange(0, length, bucket_size)
+        ends = np.minimum(starts + bucket_size, length) - 1
+        bucket_ids = np.repeat(np.arange(len(starts)), np.diff(np.append(starts, length)))
+        indices = np.arange(length)[:, None]
+        mins = np.fmin.reduceat(values, starts, axis=0)
+        maxs = np.fmax.reduceat(values, starts, axis=0)
+        min_pos = np.minimum.reduceat(np.where(values == mins[bucket_ids], indices, length), starts, axis=0)
+        max_pos = np.minimum.reduceat(np.where(values == maxs[bucket_ids], indices, length), starts, axis=0)
+        counts = (ends - starts + 1).astype(np.int64)
+        valid_counts = np.add.reduceat(~np.isnan(values), starts, axis=0, dtype=np.int64)
+        sums = np.add.reduceat(np.nan_to_num(values), starts, axis=0)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            means = np.where(valid_counts > 0, sums / valid_counts, np.nan)
+        return {
+            't_first': times[starts],
+            't_last': times[ends],
+            'count': counts,
+            'valid_count': valid_counts,
+            'min': mins,
+            'max': maxs,
+            'mean': means,
+            'min_first': min_pos <= max_pos,
+            'first': values[starts],
+            'last': values[ends],
+        }
+
+    @classmethod
+    def _merge(cls, level: dict) -> dict:
+        """Merge pairs of consecutive buckets into the next (coarser) level."""
+        pair_count = len(level['count']) // 2
+        left = {field: np.asarray(array[0:2 * pair_count:2]) for field, array in level.items()}
+        right = {field: np.asarray(array[1:2 * pair_count:2]) for field, array in level.items()}
+        min_from_left = (left['min'] <= right['min']) | np.isnan(right['min'])
+        max_from_left = (left['max'] >= right['max']) | np.isnan(right['max'])
+        valid_counts = left['valid_count'] + right['valid_count']
+        # Means of buckets without valid samples are NaN and weigh nothing
+        sums = np.where(left['valid_count'] > 0, left['mean'] * left['valid_count'], 0) + \
+            np.where(right['valid_count'] > 0, right['mean'] * right['valid_count'], 0)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            means = np.where(valid_counts > 0, sums / valid_counts, np.nan)
+        merged = {
+            't_first': left['t_first'],
+            't_last': right['t_last'],
+            'count': left['count'] + right['count'],
+            'valid_count': valid_counts,
+            'min': np.fmin(left['min'], right['min']),
+            'max': np.fmax(left['max'], right['max']),
+            'mean': means,
+            # If min and max come from different buckets, the left one comes first
+            'min_first': np.where(min_from_left == max_from_left,
+                                  np.where(min_from_left, left['min_first'], right['min_first']),
+                                  min_from_left),
+            'first': left['first'],
+            'last': right['last'],
+        }
+        if len(level['count']) % 2 == 1:
+            merged = {field: np.concatenate([merged[field], np.asarray(level[field][-1:])]) for field in merged}
+        return merged
+
+    # Fields of the units merged by m4: pyramid buckets, or raw samples seen as buckets of one sample
+    UNIT_FIELDS = ['t_first', 't_last', 'count', 'first', 'last', 'min', 'max', 'min_first']
+
+    def select_buckets(self, t_start, t_end, min_buckets: int):
+        """
+        Select the coarsest level with at least min_buckets buckets lying entirely within [t_start, t_end].
+        :param t_start: tstamp of the range start, or None for no lower bound.
+        :param t_end: tstamp of the range end, or None for no upper bound.
+        :return: (level, first, last) with the buckets [first, last) of the level, or None if even the finest
+            level has too few buckets in the range.
+        """
+        selection = None
+        for level in self.levels:
+            first = int(np.searchsorted(level['t_first'], t_start, side='left')) if t_start is not None else 0
+            last = int(np.searchsorted(level['t_last'], t_end, side='right')) if t_end is not None \
+                else len(level['t_last'])
+            if last - first < min_buckets:
+                break
+            selection = (level, first, last)
+        return selection
+
+    def get_units(self, level: dict, first: int, last: int) -> dict:
+        return {field: np.asarray(level[field][first:last]) for field in self.UNIT_FIELDS}
+
+    @classmethod
+    def samples_to_units(cls, times: np.ndarray, values: np.ndarray) -> dict:
+        return {
+            't_first': times,
+            't_last': times,
+            'count': np.ones(len(times), dtype=np.int64),
+            'first': values,
+            'last': values,
+            'min': values,
+            'max': values,
+            'min_first': np.ones(values.shape, dtype=bool),
+        }
+
+    @classmethod
+    def m4(cls, units: dict, group_count: int):
+        """
+        M4 of consecutive units, with the same layout as api.utils.StreamingM4Downsampler: the units are split
+        into group_count groups of about the same number of samples, and each group gives its first value, its
+        min and max in time order, and its last value, at 4 evenly spaced timestamps between its first and last
+        timestamps.
+        :return: (timestamps, values of shape (4 * group_count, channels)), or None if there are fewer units
+            than groups.
+        """
+        counts = units['count']
+        unit_count = len(counts)
+        if unit_count < group_count:
+            return None
+        # Each unit goes to the group its first sample falls in
+        offsets = np.cumsum(counts) - counts
+        edges = np.linspace(0, offsets[-1] + counts[-1], group_count + 1).astype(np.int64)
+        group_ids = np.searchsorted(edges, offsets, side='right') - 1
+        starts = np.flatnonzero(np.append(True, np.diff(group_ids) != 0))
+        if len(starts) != group_count:
+            return None
+        ends = np.append(starts[1:], unit_count) - 1
+        group_ids = np.repeat(np.arange(group_count), ends - starts + 1)
+
+        mins = np.fmin.reduceat(units['min'], starts, axis=0)
+        maxs = np.fmax.reduceat(units['max'], starts, axis=0)
+        # Units holding the min / max of each group; if they are the same unit, its own order is used
+        unit_indices = np.arange(unit_count)[:, None]
+        min_unit = np.minimum.reduceat(np.where(units['min'] == mins[group_ids], unit_indices, unit_count),
+                                       starts, axis=0)
+        max_unit = np.minimum.reduceat(np.where(units['max'] == maxs[group_ids], unit_indices, unit_count),
+                                       starts, axis=0)
+        # Channels without valid samples in a group have no min / max unit
+        min_unit = np.minimum(min_unit, unit_count - 1)
+        max_unit = np.minimum(max_unit, unit_count - 1)
+        min_first = np.where(min_unit == max_unit,
+                             np.take_along_axis(units['min_first'], min_unit, axis=0),
+                             min_unit < max_unit)
+
+        values = np.empty((group_count, 4, mins.shape[1]), dtype=np.float64)
+        values[:, 0] = units['first'][starts]
+        values[:, 1] = np.where(min_first, mins, maxs)
+        values[:, 2] = np.where(min_first, maxs, mins)
+        values[:, 3] = units['last'][ends]
+        t_first, t_last = units['t_first'][starts], units['t_last'][ends]
+        slots = np.array([0, 1, 2, 3]) / 3
+        times = (t_first[:, None] + (t_last - t_first)[:, None] * slots).astype(np.int64)
+        return times.reshape(-1), values.reshape(-1, mins.shape[1])
+
+
+# Reuse opened RSKCore (RSK handle, channel metadata and recently served responses) in each worker process
+RSK_CORE_POOL = CorePool(RSKCore, max_size=8)
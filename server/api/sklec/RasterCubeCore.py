@@ -0,0 +1,173 @@
+import os
+import json
+import time
+import shutil
+import hashlib
+from typing import List, Tuple
+import numpy as np
+from osgeo import gdal
+
+from api.models import *
+from api.sklec.GeoTiffCore import GeoTiffCore
+from sklecvis import settings
+
+
+class RasterCubeException(Exception):
+    pass
+
+
+class RasterCubeCore:
+    """
+    Precomputed point-series cube of an RT (raster) dataset.
+    All the visfiles of the dataset, ordered by datetime_start, are stacked into one float32 .npy array of
+    shape (row, col, time), so that the time series of a pixel is contiguous on disk and a point query is one
+    contiguous read. The cube is stored along with a manifest holding the signature of the visfiles; a cube
+    whose signature no longer matches the visfiles (added, removed or replaced) is ignored.
+    Only datasets whose visfiles share the same grid (raster size and geotransform) can be stacked.
+    """
+
+    CUBE_FOLDER_DIR = os.path.join(settings.MEDIA_ROOT, 'cache_files', 'rt_cube')
+    CUBE_FILE_NAME = 'cube.npy'
+    MANIFEST_FILE_NAME = 'manifest.json'
+    BUILD_BUFFER_SIZE = 256 * 1024 ** 2  # Max bytes of a row block stacked in memory while building
+
+    def __init__(self, cube_dir: str, manifest: dict):
+        self.cube_dir = cube_dir
+        self.manifest = manifest
+        self.geotransform = manifest['geotransform']
+        self.raster_size = manifest['raster_size']
+        self.cube = np.load(os.path.join(cube_dir, self.CUBE_FILE_NAME), mmap_mode='r')
+
+    def __str__(self):
+        return f'<SklecVis: RasterCubeCore> {self.cube_dir}'
+
+    @classmethod
+    def get_cube_dir(cls, dataset: Dataset) -> str:
+        return os.path.join(cls.CUBE_FOLDER_DIR, dataset.uuid)
+
+    @classmethod
+    def get_visfiles_signature(cls, visfiles: List[VisFile]) -> str:
+        """
+        Signature of the ordered visfiles: uuid, date, size and mtime of each file.
+        """
+        items = []
+        for visfile in visfiles:
+            stat = os.stat(visfile.file.path)
+            items.append([visfile.uuid, visfile.datetime_start.isoformat(), stat.st_size, stat.st_mtime_ns])
+        return hashlib.sha1(json.dumps(items).encode('utf-8')).hexdigest()
+
+    @classmethod
+    def get_sorted_visfiles(cls, dataset: Dataset) -> List[VisFile]:
+        visfiles = [f for f in dataset.vis_files.all() if f.format == VisFile.FileFormat.TIFF]
+        return sorted(visfiles, key=lambda x: x.datetime_start.timestamp())
+
+    @classmethod
+    def load(cls, dataset: Dataset, visfiles: List[VisFile] = None):
+        """
+        Load the cube of the dataset.
+        :param visfiles: Visfiles ordered by datetime_start. Default is all the TIFF visfiles of the dataset.
+        :return: RasterCubeCore, or None if the cube is missing or out of date.
+        """
+        cube_dir = cls.get_cube_dir(dataset)
+        manifest_path = os.path.join(cube_dir, cls.MANIFEST_FILE_NAME)
+        if not os.path.exists(manifest_path):
+            return None
+        with open(manifest_path, 'r') as f:
+            manifest = json.load(f)
+        if visfiles is None:
+            visfiles = cls.get_sorted_visfiles(dataset)
+        try:
+            signature = cls.get_visfiles_signature(visfiles)
+        except (FileNotFoundError, ValueError):
+            return None
+        if manifest.get('signature') != signature:
+            return None
+        return cls(cube_dir, manifest)
+
+    @classmethod
+    def build(cls, dataset: Dataset):
+        """
+        Build (or rebuild) the cube of an RT dataset. The cube is written to a temporary folder first and
+        then moved into place, so queries never see a partial cube.
+        :return: RasterCubeCore
+        """
+        if dataset.dataset_type != Dataset.DatasetType.RASTER:
+            raise RasterCubeException(f'Dataset {dataset.uuid} must be of Raster (RT) type.')
+        visfiles = cls.get_sorted_visfiles(dataset)
+        if len(visfiles) == 0:
+            raise RasterCubeException(f'Dataset {dataset.uuid} has no TIFF visfile.')
+        signature = cls.get_visfiles_signature(visfiles)
+
+        file_paths = [visfile.file.path for visfile in visfiles]
+        # Open every file once and keep the datasets referenced while their bands are read
+        datasets_gdal = [gdal.Open(file_path) for file_path in file_paths]
+        geotransform = list(datasets_gdal[0].GetGeoTransform())
+        raster_size = [datasets_gdal[0].RasterXSize, datasets_gdal[0].RasterYSize]
+        for file_path, dataset_gdal in zip(file_paths[1:], datasets_gdal[1:]):
+            if [dataset_gdal.RasterXSize, dataset_gdal.RasterYSize] != raster_size or \
+                    not np.allclose(dataset_gdal.GetGeoTransform(), geotransform):
+                raise RasterCubeException(f'Grid of {file_path} differs from the other visfiles.')
+
+        colnum, rownum = raster_size
+        cube_dir = cls.get_cube_dir(dataset)
+        temporary_dir = f'{cube_dir}.{os.getpid()}.{int(time.time())}'
+        os.makedirs(temporary_dir, exist_ok=True)
+        try:
+            cube = np.lib.format.open_memmap(os.path.join(temporary_dir, cls.CUBE_FILE_NAME), mode='w+',
+                                             dtype=np.float32, shape=(rownum, colnum, len(file_paths)))
+            # Stack a block of rows of every file in memory, then write the block contiguously. Blocks are
+            # aligned to the tile height, so each compressed tile is decoded once.
+            tile_rows = datasets_gdal[0].GetRasterBand(1).GetBlockSize()[1]
+            block_rows = max(1, cls.BUILD_BUFFER_SIZE // (colnum * len(file_paths) * 4))
+            block_rows = max(tile_rows, block_rows // tile_rows * tile_rows)
+            for row_start in range(0, rownum, block_rows):
+                row_end = min(row_start + block_rows, rownum)
+                block = np.empty((row_end - row_start, colnum, len(file_paths)), dtype=np.float32)
+                for t, dataset_gdal in enumerate(datasets_gdal):
+                    band = dataset_gdal.GetRasterBand(1)
+                    block[:, :, t] = band.ReadAsArray(0, row_start, colnum, row_end - row_start)
+                cube[row_start:row_end] = block
+            cube.flush()
+            del cube
+            with open(os.path.join(temporary_dir, cls.MANIFEST_FILE_NAME), 'w') as f:
+                json.dump({
+                    'signature': signature,
+                    'geotransform': geotransform,
+                    'raster_size': raster_size,
+                    'dates': [visfile.datetime_start.isoformat() for visfile in visfiles],
+                }, f)
+            if os.path.exists(cube_dir):
+                shutil.rmtree(cube_dir)
+            os.replace(temporary_dir, cube_dir)
+        finally:
+            datasets_gdal = None
+            if os.path.exists(temporary_dir):
+                shutil.rmtree(temporary_dir)
+        return cls.load(dataset, visfiles)
+
+    def get_series_by_coordinates(self, lat_lngs: List[Tuple], radius: int = 1) -> List[List[float]]:
+        """
+        Same as GeoTiffCore.get_value_by_coordinates, but returns the whole time series of every point.
+        :param lat_lngs: A list of coordinates. [(Latitude, Longitude), (Latitude, Longitude), ...]
+        :param radius: Sample radius. Defult is 1.
+        :return: [[value at time 0, value at time 1, ...] for each point]
+        """
+        colnum, rownum = self.raster_size
+        xOrigin, pixelWidth, _, yOrigin, _, pixelHeight = self.geotransform
+        pixelHeight = -pixelHeight
+        size = 2 * radius - 1
+        result = []
+        for target_lat, target_lng in lat_lngs:
+            if target_lng < xOrigin or target_lng > xOrigin + pixelWidth * colnum or \
+                    target_lat > yOrigin or target_lat < yOrigin - pixelHeight * rownum:
+                result.append([GeoTiffCore.OUTPUT_NAN_VALUE] * self.cube.shape[2])
+                continue
+            col = int((target_lng - xOrigin) / pixelWidth)
+            row = int((yOrigin - target_lat) / pixelHeight)
+            # Same sample area as GeoTiffCore._get_area_window
+            col = max(0, min(col - radius + 1, colnum - size - 1))
+            row = max(0, min(row - radius + 1, rownum - size - 1))
+            area = np.asarray(self.cube[row:row + size, col:col + size, :], dtype=np.float64)
+            series = area.mean(axis=(0, 1))
+            result.append(np.where(np.isnan(series), GeoTiffCore.OUTPUT_NAN_VALUE, series).tolist())
+        return result
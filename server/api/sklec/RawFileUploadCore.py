@@ -34,10 +34,14 @@ class RawFileUploadBaseCore:
 
 class NcfRawFileUploadCore(RawFileUploadBaseCore):
     def generate_rawfile_and_visfile(self, dataset_uuid):
+        # 上传的原始文件只会被读取一次，不放入 NCF_CORE_POOL，用完即关闭
         core = NcfCore(self.rawfile_path)
-        if not core.check_latlng():
-            raise Exception('NcfFile does not has dimension latitude or longitude.')
-        return core.save_visfile_and_rawfile_to_dataset(dataset_uuid)
+        try:
+            if not core.check_latlng():
+                raise Exception('NcfFile does not has dimension latitude or longitude.')
+            return core.save_visfile_and_rawfile_to_dataset(dataset_uuid)
+        finally:
+            core.close()
 
 
 class FormDataRawFileUploadCore(RawFileUploadBaseCore):
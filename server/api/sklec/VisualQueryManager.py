@@ -1,9 +1,14 @@
 from typing import List
+from concurrent.futures import ThreadPoolExecutor
 from api.models import *
 from api.sklec.GeoTiffCore import GeoTiffCore
+from api.sklec.RasterCubeCore import RasterCubeCore
 
 
 class VisualQueryManager:
+    # Max number of visfiles opened and sampled concurrently. GDAL releases the GIL while reading.
+    MAX_WORKERS = 8
+
     query_latlags = []
     data_stream = []
     radius = 1
@@ -13,13 +18,15 @@ class VisualQueryManager:
     def __init__(self, visfiles: List[VisFile], lat_lngs: List, **kwargs):
         """
         Visual query manager. Generating geo-spatial query data.
-        :param visfiles:
+        :param visfiles: Visfiles ordered by datetime_start.
         :param lat_lngs:
-        :param kwargs:
+        :param kwargs: radius; dataset: the RT dataset of the visfiles, whose point-series cube is used when
+            it is up to date (see RasterCubeCore).
         """
         self.visfiles = visfiles
         self.latlngs = lat_lngs
         self.radius = int(kwargs.get('radius', 1) or 1)
+        self.dataset = kwargs.get('dataset')
         self._date_series = []
 
     def add_visfile(self, visfile: VisFile):
@@ -44,12 +51,28 @@ class VisualQueryManager:
         :return:
         """
         sample_latlngns = self._get_sample_latlngs()
+        if self.dataset is not None:
+            cube = RasterCubeCore.load(self.dataset, list(self.visfiles))
+            if cube is not None:
+                self.data_stream = cube.get_series_by_coordinates(sample_latlngns, self.radius)
+                self.stream_generated = True
+                return self.data_stream
+
         self.data_stream = [[] for _ in range(len(sample_latlngns))]
-        for file in self.visfiles:
-            core = GeoTiffCore(file.file.path)
-            vals = core.get_value_by_coordinates(sample_latlngns, self.radius)
-            for i in range(len(vals)):
-                self.data_stream[i].append(vals[i])
+        file_paths = [file.file.path for file in self.visfiles]
+
+        def sample(file_path):
+            core = GeoTiffCore(file_path)
+            try:
+                return core.get_value_by_coordinates(sample_latlngns, self.radius)
+            finally:
+                core.close()
+
+        # map keeps the order of visfiles, so values stay aligned with date_series
+        with ThreadPoolExecutor(max_workers=max(1, min(self.MAX_WORKERS, len(file_paths)))) as executor:
+            for vals in executor.map(sample, file_paths):
+                for i in range(len(vals)):
+                    self.data_stream[i].append(vals[i])
         self.stream_generated = True
         return self.data_stream
 
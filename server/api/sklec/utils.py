@@ -1,3 +1,9 @@
+import os
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+
 def readable_size(num, suffix='B'):
     """
     Get readable size from bytes number.
@@ -9,4 +15,93 @@ def readable_size(num, suffix='B'):
         if abs(num) < 1024.0:
             return f'{num:3.1f}{unit}{suffix}'
         num /= 1024.0
-    return f'{num:.1f}Yi{suffix}'
\ No newline at end of file
+    return f'{num:.1f}Yi{suffix}'
+
+
+class CorePool:
+    """
+    A bounded per-process LRU pool of opened cores (NcfCore, RSKCore, ...).
+    Cores are keyed by real path, mtime and size, so a replaced file is reopened. An evicted core
+    is closed once the last request using it releases it.
+
+    Usage:
+        with pool.open(file_path) as core:
+            core.do_something()
+    """
+
+    class _Entry:
+        def __init__(self, core):
+            self.core = core
+            self.refcount = 0
+            self.evicted = False
+
+    def __init__(self, factory, max_size: int = 8):
+        """
+        :param factory: Callable that opens a core from a file path. The core must provide close().
+        :param max_size: Max number of cores kept open in this process.
+        """
+        self.factory = factory
+        self.max_size = max_size
+        self._pool = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _gen_key(file_path):
+        stat = os.stat(file_path)
+        return os.path.realpath(file_path), stat.st_mtime_ns, stat.st_size
+
+    def _evict(self, key):
+        """Remove an entry from the pool. Must be called with the lock held. Returns the core to close, if any."""
+        entry = self._pool.pop(key)
+        entry.evicted = True
+        return entry.core if entry.refcount == 0 else None
+
+    @contextmanager
+    def open(self, file_path):
+        key = self._gen_key(file_path)
+        with self._lock:
+            entry = self._pool.get(key)
+            if entry is not None:
+                self._pool.move_to_end(key)
+                entry.refcount += 1
+
+        if entry is None:
+            core = self.factory(file_path)
+            to_close = []
+            with self._lock:
+                entry = self._pool.get(key)
+                if entry is not None:
+                    # Opened concurrently by another thread, use the pooled one.
+                    to_close.append(core)
+                    self._pool.move_to_end(key)
+                else:
+                    # Older versions of the same file will never be requested again.
+                    for stale_key in [k for k in self._pool.keys() if k[0] == key[0]]:
+                        to_close.append(self._evict(stale_key))
+                    entry = self._Entry(core)
+                    self._pool[key] = entry
+                    while len(self._pool) > self.max_size:
+                        to_close.append(self._evict(next(iter(self._pool))))
+                entry.refcount += 1
+            for c in to_close:
+                if c is not None:
+                    c.close()
+
+        try:
+            yield entry.core
+        finally:
+            with self._lock:
+                entry.refcount -= 1
+                to_close = entry.core if entry.evicted and entry.refcount == 0 else None
+            if to_close is not None:
+                to_close.close()
+
+    def clear(self):
+        with self._lock:
+            to_close = [self._evict(key) for key in list(self._pool.keys())]
+        for c in to_close:
+            if c is not None:
+                c.close()
+
+    def __len__(self):
+        return len(self._pool)
@@ -3,7 +3,7 @@ import os
 from netCDF4 import Dataset
 from django.test import TestCase
 from rest_framework.test import APIRequestFactory
-from api.sklec.NcfCore import NcfCore
+from api.sklec.NcfCore import NcfCore, NcfUtils, NcfCacheManager, NCF_CORE_POOL
 from sklecvis import settings
 from api.models import *
 # Create your tests here.
@@ -71,4 +71,113 @@ class NCFTest(TestCase):
         core = NcfCore(filepath)
         core.generate_ncf_content(label='hs')
         core.generate_ncf_content(label='hs', filenum_limit = 5)
-        core.generate_ncf_content(label='hs', res_limit=100)
\ No newline at end of file
+        core.generate_ncf_content(label='hs', res_limit=100)
+
+    def test_generate_tiff_cache_hit(self):
+        ncf_dataset = self.TEST_NCFDATASETS_VALID[0]
+        filepath = os.path.join(DATASETS_FOLDER, ncf_dataset)
+        core = NcfCore(filepath)
+        params = dict(label='hs', longitude_start=100, longitude_end=200,
+                      latitude_start=100, latitude_end=200, time_index=0, res_limit=100)
+        tiff_info = core.generate_tiff(**params)
+        cached_tiff_info = core.generate_tiff(**params)
+        self.assertEqual(tiff_info.get('file_name'), cached_tiff_info.get('file_name'))
+        self.assertEqual(tiff_info.get('min_value'), cached_tiff_info.get('min_value'))
+        params['time_index'] = 1
+        self.assertNotEqual(tiff_info.get('file_name'), core.generate_tiff(**params).get('file_name'))
+
+    def test_cache_index(self):
+        ncf_dataset = self.TEST_NCFDATASETS_VALID[0]
+        filepath = os.path.join(DATASETS_FOLDER, ncf_dataset)
+        core = NcfCore(filepath)
+        tiff_info = core.generate_tiff(label='hs', longitude_start=100, longitude_end=200,
+                                       latitude_start=100, latitude_end=200, time_index=0)
+        entry = ViewTiffFile.objects.get(file_name=tiff_info.get('file_name'))
+        self.assertEqual(entry.file_size, tiff_info.get('file_size'))
+        self.assertTrue(NcfCacheManager.get_cache_size() >= entry.file_size)
+
+    def test_core_pool(self):
+        ncf_dataset = self.TEST_NCFDATASETS_VALID[0]
+        filepath = os.path.join(DATASETS_FOLDER, ncf_dataset)
+        with NCF_CORE_POOL.open(filepath) as core:
+            with NCF_CORE_POOL.open(filepath) as pooled_core:
+                self.assertIs(core, pooled_core)
+        NCF_CORE_POOL.clear()
+        self.assertEqual(len(NCF_CORE_POOL), 0)
+
+    def test_get_vqdata_content_batch(self):
+        ncf_dataset = self.TEST_NCFDATASETS_VALID[0]
+        filepath = os.path.join(DATASETS_FOLDER, ncf_dataset)
+        core = NcfCore(filepath)
+        longitude_values = core.dimension_fields.get('longitude').value[:]
+        latitude_values = core.dimension_fields.get('latitude').value[:]
+        lat_lngs = [(float(latitude_values[i]), float(longitude_values[i])) for i in (10, 20, 30)]
+        vq_data = core.get_vqdata_content_batch(label='hs', lat_lngs=lat_lngs)
+        self.assertEqual(len(vq_data['stream_data']), len(lat_lngs))
+        for lat_lng, stream_data in zip(lat_lngs, vq_data['stream_data']):
+            single_vq_data = core.get_vqdata_content(label='hs', latitude_value=lat_lng[0], longitude_value=lat_lng[1])
+            self.assertEqual(single_vq_data['stream_data'], stream_data)
+            self.assertEqual(len(single_vq_data['date_data']), len(vq_data['date_data']))
+
+    def test_read_hyperslab(self):
+        ncf_dataset = self.TEST_NCFDATASETS_VALID[0]
+        filepath = os.path.join(DATASETS_FOLDER, ncf_dataset)
+        core = NcfCore(filepath)
+        data = core.get_1d_vq_data(label='hs', longitude_index=100, latitude_index=100, depth_index=0)
+        self.assertEqual(len(data), core.dimension_fields.get('time').size)
+        self.assertTrue(core.last_read_stats.get('bytes_decompressed_estimate') >= len(data))
+        # 单点时间序列能放入 chunk cache，应一次读取完成
+        self.assertEqual(core.last_read_stats.get('blocks'), 1)
+
+    def test_generate_timeseries_store(self):
+        ncf_dataset = self.TEST_NCFDATASETS_VALID[0]
+        filepath = os.path.join(DATASETS_FOLDER, ncf_dataset)
+        core = NcfCore(filepath)
+        target_path = os.path.join(settings.MEDIA_ROOT, 'tests', 'test_4dim_timeseries.ts.nc')
+        try:
+            core.generate_timeseries_store(target_path)
+            with Dataset(target_path) as timeseries_store:
+                variable = timeseries_store.variables.get('hs')
+                time_axis = core.variable_fields.get('hs').normalized_dimensions.index('time')
+                self.assertEqual(variable.chunking()[time_axis], core.dimension_fields.get('time').size)
+                self.assertTrue((variable[:, 0, 100, 100] == core.variables.get('hs')[:, 0, 100, 100]).all())
+        finally:
+            if os.path.exists(target_path):
+                os.remove(target_path)
+
+    def test_get_2d_area_views(self):
+        ncf_dataset = self.TEST_NCFDATASETS_VALID[0]
+        filepath = os.path.join(DATASETS_FOLDER, ncf_dataset)
+        core = NcfCore(filepath)
+        area_views = core.get_2d_area_views(label='hs', longitude_start=100, longitude_end=200,
+                                            latitude_start=100, latitude_end=150,
+                                            time_range=range(0, 6, 2), depth_range=range(0, 1))
+        self.assertEqual(len(area_views), 3)
+        for (time_index, depth_index), area_view in area_views.items():
+            data_array = core.get_2d_area_data(label='hs', longitude_start=100, longitude_end=200,
+                                               latitude_start=100, latitude_end=150,
+                                               time_index=time_index, depth_index=depth_index)
+            self.assertTrue((area_view == data_array).all())
+
+    def test_generate_ncf_arrays(self):
+        ncf_dataset = self.TEST_NCFDATASETS_VALID[0]
+        filepath = os.path.join(DATASETS_FOLDER, ncf_dataset)
+        core = NcfCore(filepath)
+        ncf_arrays = list(core.generate_ncf_arrays(label='hs', longitude_start=100, longitude_end=199,
+                                                   latitude_start=100, latitude_end=199,
+                                                   res_limit=50 * 50, filenum_limit=1, dtype='float16'))
+        self.assertEqual(len(ncf_arrays), 1)
+        header, data_array = ncf_arrays[0]
+        self.assertEqual(header.get('stride'), 2)
+        self.assertEqual(data_array.shape, (50, 50))
+        frame = NcfUtils.pack_array_frame(header, data_array)
+        header_length = int.from_bytes(frame[:4], 'little')
+        self.assertEqual(len(frame), 4 + header_length + data_array.nbytes)
+
+    def test_generate_xyz_tile(self):
+        ncf_dataset = self.TEST_NCFDATASETS_VALID[0]
+        filepath = os.path.join(DATASETS_FOLDER, ncf_dataset)
+        core = NcfCore(filepath)
+        tiff_meta = core.generate_xyz_tile(label='hs', z=0, x=0, y=0)
+        self.assertTrue(os.path.exists(tiff_meta.get('file_path')))
+        self.assertEqual(core.generate_xyz_tile(label='hs', z=0, x=0, y=0), tiff_meta)
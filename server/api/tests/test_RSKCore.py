@@ -0,0 +1,44 @@
+import numpy as np
+from django.test import SimpleTestCase
+
+from api.sklec.RSKCore import RSKSummaryPyramid
+from api.utils import StreamingM4Downsampler
+
+
+class RSKSummaryPyramidTest(SimpleTestCase):
+
+    LENGTH = 10007
+
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        self.times = 1600000000000 + np.arange(self.LENGTH, dtype=np.int64) * 250
+        self.values = rng.standard_normal((self.LENGTH, 3))
+        self.values[100:300, 0] = np.nan
+        self.values[500:600, 1] = 1.0  # min 与 max 相同
+        self.values[5000, 2] = 100.0
+
+    def test_m4_of_samples(self):
+        # 以单个样本为单元时，与原始数据的流式 M4 完全一致
+        units = RSKSummaryPyramid.samples_to_units(self.times, self.values)
+        for target_size in (400, 2000):
+            sampler = StreamingM4Downsampler(self.LENGTH, target_size, 3)
+            sampler.update(self.times, self.values)
+            expected_times, expected_values = sampler.result()
+            times, values = RSKSummaryPyramid.m4(units, target_size // 4)
+            np.testing.assert_array_equal(times, expected_times)
+            np.testing.assert_array_equal(values, expected_values)
+
+    def test_m4_of_buckets(self):
+        # 以金字塔的桶为单元时，布局相同，且保留首尾值与极值
+        level = RSKSummaryPyramid._merge(RSKSummaryPyramid._summarize(self.times, self.values, 16))
+        units = {field: level[field] for field in RSKSummaryPyramid.UNIT_FIELDS}
+        times, values = RSKSummaryPyramid.m4(units, 100)
+        self.assertEqual(len(times), 400)
+        self.assertTrue(np.all(np.diff(times) >= 0))
+        self.assertEqual(times[0], self.times[0])
+        self.assertEqual(times[-1], self.times[-1])
+        np.testing.assert_array_equal(values[0], self.values[0])
+        np.testing.assert_array_equal(values[-1], self.values[-1])
+        np.testing.assert_array_equal(np.nanmax(values, axis=0), np.nanmax(self.values, axis=0))
+        np.testing.assert_array_equal(np.nanmin(values, axis=0), np.nanmin(self.values, axis=0))
+        self.assertIsNone(RSKSummaryPyramid.m4(units, len(level['count']) + 1))
@@ -0,0 +1,88 @@
+import warnings
+
+import numpy as np
+from django.test import SimpleTestCase
+
+from api.utils import downsample_lttb_indices, downsample_stride_indices, StreamingM4Downsampler, \
+    StreamingStrideDownsampler
+
+
+def first_position(column, value):
+    """column 中第一个等于 value 的位置，不存在时（全为 NaN）返回 len(column)"""
+    positions = np.flatnonzero(column == value)
+    return positions[0] if len(positions) > 0 else len(column)
+
+
+def m4_reference(times, values, target_size):
+    """逐桶计算的 M4 参考实现"""
+    if len(times) <= target_size:
+        return times, values
+    bucket_count = target_size // 4
+    body_length = len(times) - (target_size - bucket_count * 4)
+    edges = np.linspace(0, body_length, bucket_count + 1).astype(np.int64)
+    out_times, out_values = [], []
+    for start, end in zip(edges[:-1], edges[1:]):
+        bucket = values[start:end]
+        with np.errstate(invalid='ignore'), warnings.catch_warnings():
+            warnings.simplefilter('ignore', RuntimeWarning)
+            mins, maxs = np.nanmin(bucket, axis=0), np.nanmax(bucket, axis=0)
+        min_first = np.array([first_position(bucket[:, c], mins[c]) <= first_position(bucket[:, c], maxs[c])
+                              for c in range(bucket.shape[1])])
+        out_values += [bucket[0], np.where(min_first, mins, maxs), np.where(min_first, maxs, mins), bucket[-1]]
+        slots = np.array([0, 1, 2, 3]) / 3
+        out_times.append((times[start] + (times[end - 1] - times[start]) * slots).astype(np.int64))
+    return (np.concatenate(out_times + [times[body_length:]]),
+            np.concatenate([np.array(out_values), values[body_length:]]))
+
+
+def feed(sampler, times, values, chunk_size):
+    for start in range(0, len(times), chunk_size):
+        sampler.update(times[start:start + chunk_size], values[start:start + chunk_size])
+    return sampler.result()
+
+
+class StreamingDownsamplerTest(SimpleTestCase):
+
+    LENGTH = 10007
+    CHUNK_SIZES = [1, 7, 1000, 4096, LENGTH]
+
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        self.times = 1600000000000 + np.arange(self.LENGTH, dtype=np.int64) * 250
+        self.values = rng.standard_normal((self.LENGTH, 3))
+        self.values[100:300, 0] = np.nan
+        self.values[500:600, 1] = 1.0  # min 与 max 相同
+        self.values[5000, 2] = 100.0
+
+    def test_streaming_stride(self):
+        for target_size in (2000, 2001, self.LENGTH + 1):
+            indices = downsample_stride_indices(self.LENGTH, target_size)
+            for chunk_size in self.CHUNK_SIZES:
+                times, values = feed(StreamingStrideDownsampler(self.LENGTH, target_size),
+                                     self.times, self.values, chunk_size)
+                self.assertEqual(len(times), min(target_size, self.LENGTH))
+                np.testing.assert_array_equal(times, self.times[indices])
+                np.testing.assert_array_equal(values, self.values[indices])
+
+    def test_streaming_m4(self):
+        for target_size in (2000, 2001, 2003, self.LENGTH + 1):
+            expected_times, expected_values = m4_reference(self.times, self.values, target_size)
+            for chunk_size in self.CHUNK_SIZES:
+                times, values = feed(StreamingM4Downsampler(self.LENGTH, target_size, 3),
+                                     self.times, self.values, chunk_size)
+                self.assertEqual(len(times), min(target_size, self.LENGTH))
+                np.testing.assert_array_equal(times, expected_times)
+                np.testing.assert_array_equal(values, expected_values)
+
+    def test_lttb(self):
+        values = self.values.copy()
+        values[7777, :] = 1000.0  # 孤立的峰值
+        for target_size in (500, 2000, 2001):
+            indices = downsample_lttb_indices(self.times, values, target_size)
+            self.assertEqual(len(indices), target_size)
+            self.assertEqual(indices[0], 0)
+            self.assertEqual(indices[-1], self.LENGTH - 1)
+            self.assertTrue(np.all(np.diff(indices) > 0))
+            self.assertIn(7777, indices)
+        np.testing.assert_array_equal(downsample_lttb_indices(self.times, values, self.LENGTH + 1),
+                                      np.arange(self.LENGTH))
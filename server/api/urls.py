@@ -40,6 +40,7 @@ urlpatterns = [
     path('viscontent/vqdatastream/', views.PostVQDataStream.as_view(), name='vq-datastream'),
     path('viscontent/<str:uuid>/', views.GetRskContent.as_view(), name='rsk-content'),
     path('ncfcontent/vqdatastream/', views.PostNcfContentVQDatastream.as_view(), name='ncf-content-vq-datastream'),
+    path('ncfcontent/<str:uuid>/tiles/<int:z>/<int:x>/<int:y>/', views.GetNcfTile.as_view(), name='ncf-tile'),
     path('ncfcontent/<str:uuid>/', views.GetNcfContent.as_view(), name='ncf-content'),
     path('tags/', views.DatasetTags.as_view()),
     path('tags/<str:uuid>/', views.DatasetTagUUID.as_view()),
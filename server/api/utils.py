@@ -1,18 +1,178 @@
-from typing import List
-
 import numpy as np
 
-def downsample1d(array: List, target_size):
+
+DOWNSAMPLE_ALGORITHMS = ['stride', 'm4', 'lttb']
+
+
+def downsample_stride_indices(length: int, target_size: int) -> np.ndarray:
     """
-    Downsample 1D array to target size. May not be perfect.
-    :param array:
+    Indices of exactly target_size evenly spaced samples (all the samples if there are not enough).
+    :param length: Number of samples.
     :param target_size:
     :return:
     """
-    if target_size > len(array):
-        return array
-    if len(array) / target_size > 2:
-        distance = len(array) // target_size
-        return array[::distance]
-    else:
-        return array
\ No newline at end of file
+    if length <= target_size:
+        return np.arange(length)
+    return np.linspace(0, length - 1, target_size).round().astype(np.int64)
+
+
+def downsample_lttb_indices(times: np.ndarray, values: np.ndarray, target_size: int) -> np.ndarray:
+    """
+    Largest-Triangle-Three-Buckets downsampling over several channels sharing the time axis.
+    Channels are normalized to [0, 1], and the point of each bucket maximizing the sum of triangle areas
+    over the channels is selected.
+    :param times: 1D int64 array of timestamps, ascending.
+    :param values: 2D array of shape (samples, channels).
+    :param target_size:
+    :return: Indices of exactly target_size samples (all the samples if there are not enough).
+    """
+    length = len(times)
+    if length <= target_size or target_size < 3:
+        return downsample_stride_indices(length, target_size)
+    x = (times - times[0]).astype(np.float64)
+    value_min, value_max = np.nanmin(values, axis=0), np.nanmax(values, axis=0)
+    value_range = np.where(value_max > value_min, value_max - value_min, 1)
+    y = np.nan_to_num((values - value_min) / value_range)
+
+    # The first and the last points are always kept, the rest are split into target_size - 2 buckets
+    edges = np.linspace(1, length - 1, target_size - 1).astype(np.int64)
+    selected = np.empty(target_size, dtype=np.int64)
+    selected[0], selected[-1] = 0, length - 1
+    a = 0
+    for i in range(target_size - 2):
+        start, end = edges[i], edges[i + 1]
+        if i + 2 < len(edges):
+            next_x = x[edges[i + 1]:edges[i + 2]].mean()
+            next_y = y[edges[i + 1]:edges[i + 2]].mean(axis=0)
+        else:
+            next_x, next_y = x[-1], y[-1]
+        areas = np.abs((x[a] - next_x) * (y[start:end] - y[a]) -
+                       (x[a] - x[start:end])[:, None] * (next_y - y[a])).sum(axis=1)
+        a = start + int(np.argmax(areas))
+        selected[i + 1] = a
+    return selected
+
+
+class StreamingStrideDownsampler:
+    """
+    Streaming version of downsample_stride_indices: samples are fed chunk by chunk, and only the selected ones
+    are kept, so memory does not depend on the number of samples.
+    """
+
+    def __init__(self, length: int, target_size: int):
+        """
+        :param length: Total number of samples that will be fed.
+        :param target_size:
+        """
+        self.indices = downsample_stride_indices(length, target_size)
+        self.offset = 0
+        self.times, self.values = [], []
+
+    def update(self, times: np.ndarray, values: np.ndarray):
+        start, end = np.searchsorted(self.indices, [self.offset, self.offset + len(times)])
+        selected = self.indices[start:end] - self.offset
+        self.times.append(times[selected])
+        self.values.append(values[selected])
+        self.offset += len(times)
+
+    def result(self):
+        if len(self.times) == 0:
+            return np.empty(0, dtype=np.int64), np.empty((0, 0), dtype=np.float64)
+        return np.concatenate(self.times), np.concatenate(self.values)
+
+
+class StreamingM4Downsampler:
+    """
+    Streaming M4 downsampling: each bucket is represented by its first, min, max and last values, so spikes are
+    kept. All the channels share the time axis: the 4 points of a bucket are placed at evenly spaced timestamps
+    between the first and the last timestamp of the bucket, and min / max keep the order in which they occur.
+    If target_size is not a multiple of 4, the last samples are appended as they are.
+    Samples are fed chunk by chunk and only the per-bucket aggregates are kept, so memory does not depend on
+    the number of samples.
+    """
+
+    def __init__(self, length: int, target_size: int, channel_count: int):
+        """
+        :param length: Total number of samples that will be fed.
+        :param target_size:
+        :param channel_count: Number of channels (columns of values).
+        """
+        self.length = length
+        self.offset = 0
+        self.passthrough = length <= target_size
+        self.tail_times, self.tail_values = [], []
+        if self.passthrough:
+            self.body_length = 0
+            return
+        bucket_count = target_size // 4
+        self.body_length = length - (target_size - bucket_count * 4)
+        self.edges = np.linspace(0, self.body_length, bucket_count + 1).astype(np.int64)
+        shape = (bucket_count, channel_count)
+        self.seen = np.zeros(bucket_count, dtype=bool)
+        self.t_first = np.zeros(bucket_count, dtype=np.int64)
+        self.t_last = np.zeros(bucket_count, dtype=np.int64)
+        self.first = np.full(shape, np.nan)
+        self.last = np.full(shape, np.nan)
+        self.mins = np.full(shape, np.nan)
+        self.maxs = np.full(shape, np.nan)
+        self.min_pos = np.full(shape, length, dtype=np.int64)
+        self.max_pos = np.full(shape, length, dtype=np.int64)
+
+    def update(self, times: np.ndarray, values: np.ndarray):
+        body_count = max(0, min(len(times), self.body_length - self.offset))
+        if body_count > 0:
+            self._update_body(times[:body_count], values[:body_count].astype(np.float64))
+        if body_count < len(times):
+            self.tail_times.append(times[body_count:])
+            self.tail_values.append(values[body_count:].astype(np.float64))
+        self.offset += len(times)
+
+    def _update_body(self, times: np.ndarray, values: np.ndarray):
+        indices = self.offset + np.arange(len(times))
+        bucket_ids = np.searchsorted(self.edges, indices, side='right') - 1
+        starts = np.flatnonzero(np.r_[True, np.diff(bucket_ids) != 0])
+        ends = np.r_[starts[1:], len(times)] - 1
+        buckets = bucket_ids[starts]
+        group_ids = np.repeat(np.arange(len(starts)), np.diff(np.r_[starts, len(times)]))
+
+        mins = np.fmin.reduceat(values, starts, axis=0)
+        maxs = np.fmax.reduceat(values, starts, axis=0)
+        min_pos = np.minimum.reduceat(np.where(values == mins[group_ids], indices[:, None], self.length), starts,
+                                      axis=0)
+        max_pos = np.minimum.reduceat(np.where(values == maxs[group_ids], indices[:, None], self.length), starts,
+                                      axis=0)
+
+        new = ~self.seen[buckets]
+        self.t_first[buckets[new]] = times[starts[new]]
+        self.first[buckets[new]] = values[starts[new]]
+        self.seen[buckets] = True
+        self.t_last[buckets] = times[ends]
+        self.last[buckets] = values[ends]
+
+        # On ties the earlier sample (already seen) is kept
+        current_mins, current_maxs = self.mins[buckets], self.maxs[buckets]
+        min_better = (mins < current_mins) | (np.isnan(current_mins) & ~np.isnan(mins))
+        max_better = (maxs > current_maxs) | (np.isnan(current_maxs) & ~np.isnan(maxs))
+        self.mins[buckets] = np.where(min_better, mins, current_mins)
+        self.maxs[buckets] = np.where(max_better, maxs, current_maxs)
+        self.min_pos[buckets] = np.where(min_better, min_pos, self.min_pos[buckets])
+        self.max_pos[buckets] = np.where(max_better, max_pos, self.max_pos[buckets])
+
+    def result(self):
+        tail_times = np.concatenate(self.tail_times) if self.tail_times else np.empty(0, dtype=np.int64)
+        tail_values = np.concatenate(self.tail_values) if self.tail_values else None
+        if self.passthrough:
+            return tail_times, tail_values if tail_values is not None else np.empty((0, 0), dtype=np.float64)
+        bucket_count, channel_count = self.mins.shape
+        min_first = self.min_pos <= self.max_pos
+        out_values = np.empty((bucket_count, 4, channel_count), dtype=np.float64)
+        out_values[:, 0] = self.first
+        out_values[:, 1] = np.where(min_first, self.mins, self.maxs)
+        out_values[:, 2] = np.where(min_first, self.maxs, self.mins)
+        out_values[:, 3] = self.last
+        slots = np.array([0, 1, 2, 3]) / 3
+        out_times = (self.t_first[:, None] + (self.t_last - self.t_first)[:, None] * slots).astype(np.int64)
+        out_values = out_values.reshape(-1, channel_count)
+        if tail_values is None:
+            return out_times.reshape(-1), out_values
+        return np.concatenate([out_times.reshape(-1), tail_times]), np.concatenate([out_values, tail_values])
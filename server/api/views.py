@@ -3,12 +3,14 @@ import json
 import traceback
 import urllib.parse
 import urllib
+import zlib
+from contextlib import ExitStack
 from json import JSONDecodeError
 from typing import Dict, List
 
 
 from django.core.files.uploadedfile import UploadedFile
-from django.http import JsonResponse, HttpRequest, HttpResponse
+from django.http import JsonResponse, HttpRequest, HttpResponse, StreamingHttpResponse, FileResponse
 from django.middleware.csrf import get_token
 from django.contrib.auth import authenticate, login, logout
 from django.contrib.auth.models import Permission, User, Group
@@ -28,8 +30,8 @@ from api.authentication import CsrfExemptSessionAuthentication
 from api.serializers import *
 from api.api_serializers import *
 from api.sklec.RawFileUploadCore import NcfRawFileUploadCore, FormDataRawFileUploadCore
-from api.sklec.RSKCore import RSKCore
-from api.sklec.NcfCore import NcfCoreClass, NcfCore
+from api.sklec.RSKCore import RSKCore, RSK_CORE_POOL
+from api.sklec.NcfCore import NcfCoreClass, NcfCore, NcfUtils, NCF_CORE_POOL
 from api.sklec.FormDataCore import FormDataCore
 from api.sklec.VisualQueryManager import VisualQueryManager
 from api.models import Dataset
@@ -48,6 +50,25 @@ def JsonResponseError(message: str, error = None, status: int = status.HTTP_400_
         'error': error
     }, status=status)
 
+class ClosingStream:
+    """
+    StreamingHttpResponse 的内容：Django 在响应关闭时调用 close()，即使生成器从未开始迭代
+    （例如客户端提前断开），on_close 也会被执行
+    """
+
+    def __init__(self, iterator, on_close):
+        self.iterator = iterator
+        self.on_close = on_close
+
+    def __iter__(self):
+        return iter(self.iterator)
+
+    def close(self):
+        try:
+            self.iterator.close()
+        finally:
+            self.on_close()
+
 class DatasetList(generics.ListAPIView):
 
     serializer_class = DatasetSerializer
@@ -372,27 +393,26 @@ class PostNcfContentVQDatastream(views.APIView):
             for lat_lng, visfile_uuid in zip(lat_lngs, visfile_uuids):
                 try:
                     visfile = VisFile.objects.get(uuid=visfile_uuid)
-                    core = NcfCore(visfile.file.path)
                 except VisFile.DoesNotExist as e:
                     return JsonResponseError(f'VisFile with uuid {visfile_uuid} does not exist.')
 
-                vq_data = core.get_vqdata_content(label=params['channel_label'], longitude_value=lat_lng['lng'],
-                                                  latitude_value=lat_lng['lat'], depth_value = params['dep'])
+                with NCF_CORE_POOL.open(visfile.file.path) as core:
+                    vq_data = core.get_vqdata_content(label=params['channel_label'], longitude_value=lat_lng['lng'],
+                                                      latitude_value=lat_lng['lat'], depth_value = params['dep'])
                 stream_data.append(vq_data.get('stream_data'))
                 date_data.extend(vq_data.get('date_data'))
         else:
             visfile_uuid = visfile_uuids[0]
             try:
                 visfile = VisFile.objects.get(uuid=visfile_uuid)
-                core = NcfCore(visfile.file.path)
             except VisFile.DoesNotExist as e:
                 return JsonResponseError(f'VisFile with uuid {visfile_uuid} does not exist.')
-            stream_data = []
-            for lat_lng in lat_lngs:
-                vq_data = core.get_vqdata_content(label=params['channel_label'], longitude_value=lat_lng['lng'],
-                                                  latitude_value=lat_lng['lat'], depth_value=params['dep'])
-                stream_data.append(vq_data['stream_data'])
-                date_data = vq_data['date_data']
+            with NCF_CORE_POOL.open(visfile.file.path) as core:
+                vq_data = core.get_vqdata_content_batch(label=params['channel_label'],
+                                                        lat_lngs=[(lat_lng['lat'], lat_lng['lng']) for lat_lng in lat_lngs],
+                                                        depth_value=params['dep'])
+            stream_data = vq_data['stream_data']
+            date_data = vq_data['date_data']
         vqdata_response = {'date_data': date_data, 'stream_data': stream_data, 'lat_lngs': lat_lngs}
         return JsonResponseOK(data=vqdata_response)
 
@@ -433,16 +453,17 @@ class GetRskContent(views.APIView):
         if visfile.format == VisFile.FileFormat.RSK:
 
             try:
-                core = RSKCore(visfile.file.path)
                 print(params)
-                if params.get('target_samples'):
-                    core.TARGET_VIS_LENGTH = int(params['target_samples'])
-                vis_data = core.get_all_channel_data(start_time=datetime_start, end_time=datetime_end)
-                core.close()
+                with RSK_CORE_POOL.open(visfile.file.path) as core:
+                    vis_data = core.get_all_channel_data(start_time=datetime_start, end_time=datetime_end,
+                                                         time_format=params.get('time_format') or 'iso',
+                                                         smooth_algorithm=params.get('smooth_algorithm'),
+                                                         target_samples=params.get('target_samples'))
+                    channel_labels = core.get_channels()
                 return JsonResponseOK({
                     'vis_data': vis_data,
                     'channels': [name for name in vis_data.keys()],
-                    'channel_labels': core.get_channels(),
+                    'channel_labels': channel_labels,
                     'sample_count': len(vis_data[visfile.first_dimension_name]),
                     'datetime_start': vis_data[visfile.first_dimension_name][0],
                     'datetime_end': vis_data[visfile.first_dimension_name][-1],
@@ -483,6 +504,7 @@ class PostVQDataStream(views.APIView):
         lat_lngs = params.get('lat_lngs')
         radius = params.get('radius', 1)
         visfile_final = []
+        dataset_final = None
         if params.get('visfile_uuid') and len(params.get('visfile_uuid')) > 0:
             for uuid in params.get('visfile_uuid'):
                 try:
@@ -500,6 +522,7 @@ class PostVQDataStream(views.APIView):
             if datasetObj.dataset_type != Dataset.DatasetType.RASTER:
                 return JsonResponseError('Dataset must be of Raster (RT) type.')
             visfile_final = datasetObj.vis_files.all()
+            dataset_final = datasetObj
         else:
             return JsonResponseError('Either visfile_uuid or dataset_uuid must be provided.')
         if len(visfile_final) == 0:
@@ -513,7 +536,8 @@ class PostVQDataStream(views.APIView):
 
         manager = VisualQueryManager(visfiles=visfile_final,
                                      lat_lngs=lat_lngs_tuples,
-                                     radius=radius)
+                                     radius=radius,
+                                     dataset=dataset_final)
         manager.gen_data_stream()
         return JsonResponseOK({
             'date_data': manager.date_series,
@@ -669,19 +693,71 @@ class GetNcfContent(views.APIView):
         except VisFile.DoesNotExist as e:
             return JsonResponseError(f'VisFile with uuid {uuid} does not exist.')
 
-        core = NcfCore(visfile.file.path)
-        ncf_content = core.generate_ncf_content(
-            label=params['channel_label'],
-            longitude_start=params['longitude_start'], longitude_end=params['longitude_end'],
-            latitude_start=params['latitude_start'], latitude_end=params['latitude_end'],
-            time_start=params['datetime_start'], time_end=params['datetime_end'],
-            depth_start=params['depth_start'], depth_end=params['depth_end'],
-            res_limit=params['res_limit'], filenum_limit=params['filenum_limit'])
+        if params.get('return_type') == 'array':
+            return self.get_array_response(visfile, params)
+
+        with NCF_CORE_POOL.open(visfile.file.path) as core:
+            ncf_content = core.generate_ncf_content(
+                label=params['channel_label'],
+                longitude_start=params['longitude_start'], longitude_end=params['longitude_end'],
+                latitude_start=params['latitude_start'], latitude_end=params['latitude_end'],
+                time_start=params['datetime_start'], time_end=params['datetime_end'],
+                depth_start=params['depth_start'], depth_end=params['depth_end'],
+                res_limit=params['res_limit'], filenum_limit=params['filenum_limit'],
+                cog=params.get('cog') or False)
         for f in ncf_content:
             url = f['file_path'].replace(settings.MEDIA_ROOT, '/media')
             f['file'] = request.build_absolute_uri(url)
         return JsonResponseOK(data={'files': ncf_content})
 
+    COMPRESS_WBITS = {
+        'gzip': 16 + zlib.MAX_WBITS,
+        'deflate': zlib.MAX_WBITS,
+    }
+
+    def get_array_response(self, visfile, params):
+        """
+        以二进制帧流的形式返回各切片的数组，不生成 tiff。帧格式见 NcfUtils.pack_array_frame，
+        可选 float16 量化与 gzip / deflate 压缩
+        """
+        # 流式响应在视图返回后才被迭代，core 需在迭代结束后才归还
+        core_stack = ExitStack()
+        core = core_stack.enter_context(NCF_CORE_POOL.open(visfile.file.path))
+        try:
+            ncf_arrays = core.generate_ncf_arrays(
+                label=params['channel_label'],
+                longitude_start=params['longitude_start'], longitude_end=params['longitude_end'],
+                latitude_start=params['latitude_start'], latitude_end=params['latitude_end'],
+                time_start=params['datetime_start'], time_end=params['datetime_end'],
+                depth_start=params['depth_start'], depth_end=params['depth_end'],
+                res_limit=params['res_limit'], filenum_limit=params['filenum_limit'],
+                dtype=params.get('array_dtype') or 'float32')
+        except AssertionError as e:
+            core_stack.close()
+            return JsonResponseError(str(e))
+        except Exception:
+            core_stack.close()
+            raise
+        compress = params.get('compress')
+
+        def stream():
+            try:
+                compressor = zlib.compressobj(wbits=self.COMPRESS_WBITS.get(compress)) if compress else None
+                for header, data_array in ncf_arrays:
+                    frame = NcfUtils.pack_array_frame(header, data_array)
+                    yield compressor.compress(frame) if compressor is not None else frame
+                if compressor is not None:
+                    yield compressor.flush()
+            finally:
+                core_stack.close()
+
+        # core 在响应关闭时归还；ExitStack 可重复关闭，生成器结束时已归还则不会重复归还
+        response = StreamingHttpResponse(ClosingStream(stream(), core_stack.close),
+                                         content_type='application/octet-stream')
+        if compress:
+            response['Content-Encoding'] = compress
+        return response
+
         # channel_label = params['channel_label']
         # channel_label_exists = 0
         # for dimension in visfile.meta_data['variables']:
@@ -745,6 +821,40 @@ class GetNcfContent(views.APIView):
         # return JsonResponseOK(data=data)
 
 
+class GetNcfTile(views.APIView):
+    # permission_classes = [IsAuthenticated]
+
+    @swagger_auto_schema(operation_description='获取指定 VisFile 中指定 Channel 的 XYZ(EPSG:3857) tiff 瓦片(仅限NCF)，'
+                                               '瓦片与数据范围不相交时返回 204',
+                         query_serializer=GetNcfTileRequestSerializer,
+                         response={
+                             400: ErrorResponseSerializer,
+                             500: ErrorResponseSerializer,
+                         })
+    def get(self, request, *args, **kwargs):
+        validation = GetNcfTileRequestSerializer(data=request.query_params)
+        if not validation.is_valid():
+            return JsonResponseError(validation.errors)
+        params = validation.data
+        uuid = kwargs['uuid']
+        try:
+            visfile = VisFile.objects.get(uuid=uuid)
+        except VisFile.DoesNotExist as e:
+            return JsonResponseError(f'VisFile with uuid {uuid} does not exist.')
+
+        try:
+            with NCF_CORE_POOL.open(visfile.file.path) as core:
+                tiff_meta = core.generate_xyz_tile(label=params['channel_label'],
+                                                   z=kwargs['z'], x=kwargs['x'], y=kwargs['y'],
+                                                   time_index=params.get('datetime'),
+                                                   depth_index=params.get('depth'))
+        except AssertionError as e:
+            return JsonResponseError(str(e))
+        if tiff_meta is None:
+            return HttpResponse(status=status.HTTP_204_NO_CONTENT)
+        return FileResponse(open(tiff_meta['file_path'], 'rb'), content_type='image/tiff')
+
+
 class Login(views.APIView):
 
     authentication_classes = (CsrfExemptSessionAuthentication, )
@@ -0,0 +1,27 @@
+import os
+import django
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'sklecvis.settings')
+django.setup()
+
+from api.models import *
+from api.sklec.RSKCore import RSKCore, RSKSummaryPyramid
+
+
+def main():
+    visfiles = VisFile.objects.filter(format=VisFile.FileFormat.RSK)
+    print('Total RSK visfile number:', len(visfiles))
+    for visfile in visfiles:
+        if RSKSummaryPyramid.load(visfile.file.path) is not None:
+            print(f'Pyramid of visfile {visfile.uuid} is up to date.')
+            continue
+        try:
+            core = RSKCore(visfile.file.path)
+            pyramid = RSKSummaryPyramid.build(core, visfile.file.path)
+            core.close()
+            print(f'Build pyramid of visfile {visfile.uuid} succeed. {len(pyramid.levels)} level(s).')
+        except Exception as e:
+            print(f'Build pyramid of visfile {visfile.uuid} failed. message: {e.args}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,32 @@
+import os
+import sys
+import django
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'sklecvis.settings')
+django.setup()
+
+from api.models import *
+from api.sklec.RasterCubeCore import RasterCubeCore, RasterCubeException
+
+
+def main():
+    """
+    Build the point-series cubes of RT datasets. Usage: python build_rt_cube.py [dataset_uuid ...]
+    Without arguments, all the RT datasets whose cube is missing or out of date are (re)built.
+    """
+    datasets = Dataset.objects.filter(dataset_type=Dataset.DatasetType.RASTER)
+    if len(sys.argv) > 1:
+        datasets = datasets.filter(uuid__in=sys.argv[1:])
+    for dataset in datasets:
+        if len(sys.argv) == 1 and RasterCubeCore.load(dataset) is not None:
+            print(f'Cube of dataset {dataset.uuid} is up to date.')
+            continue
+        print(f'Building cube of dataset {dataset.uuid} ({dataset.name})')
+        try:
+            cube = RasterCubeCore.build(dataset)
+            print(f'Build cube succeed. shape {cube.cube.shape}.')
+        except RasterCubeException as e:
+            print(f'Build cube of dataset {dataset.uuid} failed. message: {e.args}')
+
+
+if __name__ == '__main__':
+    main()
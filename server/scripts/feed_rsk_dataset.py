@@ -6,6 +6,7 @@ os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'sklecvis.settings')
 django.setup()
 
 from api.models import *
+from api.sklec.RSKCore import RSKCore, RSKSummaryPyramid
 BASE_DIR = os.path.join(os.path.dirname(__file__), '..')
 user = SiteUser.objects.first()
 files = os.listdir(os.path.join(BASE_DIR, 'local/dataset/ruskins'))
@@ -49,6 +50,11 @@ for f in files:
                                      )
     visfile.save()
 
+    # Summary pyramid next to the visfile, so that zooming does not re-read the raw samples
+    core = RSKCore(visfile.file.path)
+    RSKSummaryPyramid.build(core, visfile.file.path)
+    core.close()
+
     rawfile = RawFile(dataset=dataset,
                       file_name=os.path.basename(full_path),
                       file_size=os.path.getsize(full_path),
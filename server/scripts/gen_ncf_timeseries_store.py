@@ -0,0 +1,26 @@
+import os
+import django
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'sklecvis.settings')
+django.setup()
+
+from api.models import *
+from api.sklec.NcfCore import NcfCore
+
+
+def main():
+    print('Total visfile number:', len(VisFile.objects.all()))
+    for visfile in VisFile.objects.all():
+        if visfile.format != 'ncf' or visfile.dataset is None:
+            continue
+        print(visfile.file.name)
+        try:
+            core = NcfCore(visfile.file.path)
+            target_path = core.generate_timeseries_store()
+            core.close()
+            print(f'Generate timeseries store {target_path} succeed. visfile uuid {visfile.uuid}.')
+        except Exception as e:
+            print(f'Generate timeseries store failed. visfile uuid {visfile.uuid}. message: {e.args}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,16 @@
+import os
+import django
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'sklecvis.settings')
+django.setup()
+
+from api.sklec.NcfCore import NcfCacheManager
+
+
+def main():
+    registered, removed = NcfCacheManager.rebuild_index()
+    print(f'Rebuild nc_to_tiff cache index succeed. {registered} file(s) registered, {removed} stale entry(s) removed.')
+    print(f'Current cache size: {NcfCacheManager.get_cache_size()} bytes.')
+
+
+if __name__ == '__main__':
+    main()
@@ -181,6 +181,13 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 # SKLECVIS Settings
 UUID_SHORT_LENGTH = 9
+# Generate a time-contiguous copy (<name>.ts.nc) of ncf visfiles after ingest to speed up time series queries.
+# The copy is generated in a background thread, not in the upload request: it reads the source about
+# (variable size / NcfCore.TIMESERIES_COPY_BYTES) times, so multi-GB files take tens of passes. For large
+# files prefer scripts/gen_ncf_timeseries_store.py.
+NCF_GEN_TIMESERIES_STORE = False
+# Max number of threads rendering ncf tiffs concurrently within a single request.
+NCF_TIFF_WORKERS = 4
 
 # Email Send Settings
 EMAIL_HOST = 'smtp.163.com'